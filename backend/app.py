@@ -4,7 +4,10 @@ from starlette.middleware.sessions import SessionMiddleware
 from contextlib import asynccontextmanager
 import os
 
-from core.database import init_db, close_db
+from core.database import init_db, close_db, get_db
+from core.events import start_trial_events, stop_trial_events
+from core.metrics import MetricsMiddleware, start_runtime_metrics, stop_runtime_metrics
+from core.http_client import close_http_client
 from routes.health import router as health_router
 from routes.trials import router as trials_router
 from routes.oauth import router as oauth_router
@@ -16,9 +19,14 @@ async def lifespan(app: FastAPI):
     print("🚀 Starting FreeFromTrial API...")
     await init_db()
     print("✅ Database connected and indexed")
+    start_trial_events(get_db())
+    start_runtime_metrics()
     yield
     print("🛑 Shutting down...")
+    await stop_trial_events()
+    await stop_runtime_metrics()
     close_db()
+    await close_http_client()
     print("✅ Database connection closed")
 
 # Create FastAPI app
@@ -62,8 +70,12 @@ app.add_middleware(
     allow_credentials=True,  # Important for cookies/sessions
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],  # GET /trials pagination, If-Match
 )
 
+# 3. Request timings for /metrics (added last = outermost: sessions and CORS are timed too)
+app.add_middleware(MetricsMiddleware)
+
 # ============================================
 # Routes
 # ============================================
@@ -87,3 +99,7 @@ app.include_router(trials_router)
 app.include_router(webhooks_router)
 from routes.jobs import router as jobs_router
 app.include_router(jobs_router)
+from routes.gmail_push import router as gmail_push_router
+app.include_router(gmail_push_router)
+from routes.metrics import router as metrics_router
+app.include_router(metrics_router)
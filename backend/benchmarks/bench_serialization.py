@@ -0,0 +1,100 @@
+# benchmarks/bench_serialization.py
+"""
+Micro-benchmark: encoding a GET /trials body of N trials.
+
+    cd backend && python -m benchmarks.bench_serialization --trials 1000 10000
+
+before     : what FastAPI did for a returned list of dicts, jsonable_encoder
+             then JSONResponse
+validated  : response_model validation + pydantic JSON dump + FastJSONResponse
+after      : FastJSONResponse on the documents as MongoDB returns them
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+from typing import List
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter
+
+from core.responses import FastJSONResponse
+from routes.trials import TrialOut
+
+SERVICES = ["Netflix", "Spotify", "Disney+", "Canva Pro", "Notion", "Adobe CC", "Duolingo Super"]
+
+
+def synthetic_trials(n, rng):
+    """Rows as the GET /trials aggregation returns them (naive UTC datetimes, str _id)."""
+    now = datetime(2026, 1, 1)
+    out = []
+    for _ in range(n):
+        created = now - timedelta(seconds=rng.randint(0, 90 * 86400), milliseconds=rng.randint(0, 999))
+        doc = {
+            "_id": str(ObjectId()),
+            "userId": str(ObjectId()),
+            "serviceName": rng.choice(SERVICES),
+            "endDate": now + timedelta(days=rng.randint(0, 60)),
+            "cancelUrl": rng.choice([None, "https://example.com/account/cancel"]),
+            "renewalPrice": rng.choice([None, 9.99, 14.99, 119.0]),
+            "status": rng.choice(["detected", "confirmed", "canceled"]),
+            "createdAt": created,
+            "updatedAt": created,
+            "daysLeft": rng.randint(0, 60),
+        }
+        if rng.random() < 0.5:
+            doc.update({"currency": "EUR", "source": "gmail", "links": {"gmailMessageId": "18c2f0a9d4e1b7c3"}})
+        out.append(doc)
+    return out
+
+
+def before(docs):
+    return JSONResponse(jsonable_encoder(docs)).body
+
+
+_adapter = TypeAdapter(List[TrialOut])
+
+def validated(docs):
+    return FastJSONResponse(_adapter.dump_python(_adapter.validate_python(docs), mode="json", by_alias=True)).body
+
+
+def after(docs):
+    return FastJSONResponse(docs).body
+
+
+def best_of(fn, docs, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = fn(docs)
+        best = min(best, time.perf_counter() - start)
+    return body, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--trials", type=int, nargs="+", default=[1_000, 10_000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    for n in args.trials:
+        docs = synthetic_trials(n, rng)
+        expected, t_before = best_of(before, docs, args.repeat)
+        _, t_validated = best_of(validated, docs, args.repeat)
+        got, t_after = best_of(after, docs, args.repeat)
+
+        if got != expected:
+            raise SystemExit("FastJSONResponse body differs from jsonable_encoder + JSONResponse")
+
+        print(f"trials: {n}  body: {len(got) / 1024:,.0f} KiB  (best of {args.repeat})")
+        print(f"  before    : {t_before * 1000:8.1f} ms")
+        print(f"  validated : {t_validated * 1000:8.1f} ms  ({t_before / t_validated:.1f}x)")
+        print(f"  after     : {t_after * 1000:8.1f} ms  ({t_before / t_after:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+# benchmarks/fake_gmail.py
+"""
+Fake Gmail API + OAuth token endpoint serving synthetic mailboxes, for load tests.
+
+    cd backend && python -m benchmarks.fake_gmail --port 8090 --latency-ms 40 --rate-429 0.02
+
+Point the backend at it with
+    GMAIL_API_BASE=http://127.0.0.1:8090 GOOGLE_TOKEN_URI=http://127.0.0.1:8090/token
+
+A refresh token "bench-<n>" gets the access token "bench-<n>", which opens
+mailbox n. Mailboxes are generated from (seed, n), so every run sees the same
+mail: --messages per mailbox, one an hour going back from server start,
+--trial-ratio of them free-trial emails the detector and extractor pick up.
+history.list reports no new mail, so incremental rescans are quiet.
+
+Every Gmail call waits --latency-ms (+ up to --jitter-ms) and fails with a
+429 rateLimitExceeded with probability --rate-429. GET /_stats returns the
+calls served per endpoint and the 429s sent.
+"""
+import argparse
+import asyncio
+import random
+import re
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from urllib.parse import parse_qs
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+
+SERVICES = ["Netflix", "Spotify", "Disney+", "Canva", "Notion", "Adobe", "Duolingo", "Audible", "Hulu", "Figma"]
+NOISE = [
+    ("Your order has shipped", "orders@shop.example.com"),
+    ("Team meeting tomorrow", "alice@example.com"),
+    ("Weekly digest", "news@medium.com"),
+    ("Security alert", "no-reply@accounts.example.com"),
+    ("Photos from the weekend", "bob@example.com"),
+]
+HISTORY_ID = "100000"
+_BATCH_GET = re.compile(r"GET /gmail/v1/users/me/messages/(?P<id>[0-9a-f]+)")
+
+
+def _message(mailbox: int, index: int, *, seed: int, trial_ratio: float, started_ms: int) -> dict:
+    rng = random.Random(f"{seed}:{mailbox}:{index}")
+    internal_date = started_ms - index * 3_600_000
+    if rng.random() < trial_ratio:
+        service = rng.choice(SERVICES)
+        received = datetime.fromtimestamp(internal_date / 1000, tz=timezone.utc)
+        end = received + timedelta(days=rng.randint(3, 30))
+        price = rng.choice(["9.99", "14.99", "4.99", "119"])
+        subject = f"Your {service} free trial ends on {end:%B} {end.day}"
+        sender = f"{service} <no-reply@{service.lower().rstrip('+')}.com>"
+        snippet = f"Your trial ends on {end:%B} {end.day}. You will be charged ${price} per month. Cancel anytime."
+    else:
+        subject, sender = rng.choice(NOISE)
+        snippet = "Hello, here is an update about your account and recent activity."
+    return {
+        "id": f"{mailbox:06x}{index:010x}",
+        "threadId": f"{mailbox:06x}{index:010x}",
+        "labelIds": ["INBOX"],
+        "snippet": snippet,
+        "internalDate": str(internal_date),
+        "payload": {"headers": [
+            {"name": "From", "value": sender},
+            {"name": "Subject", "value": subject},
+            {"name": "Date", "value": datetime.fromtimestamp(internal_date / 1000, tz=timezone.utc).strftime("%a, %d %b %Y %H:%M:%S +0000")},
+        ]},
+    }
+
+
+def create_app(
+    *,
+    latency_ms: float = 0,
+    jitter_ms: float = 0,
+    rate_429: float = 0,
+    messages: int = 200,
+    trial_ratio: float = 0.1,
+    seed: int = 42,
+) -> FastAPI:
+    app = FastAPI(title="Fake Gmail API")
+    started_ms = int(time.time() * 1000)
+    calls: Counter = Counter()
+    rng = random.Random(seed)
+
+    def mailbox(request: Request) -> int:
+        token = request.headers.get("Authorization", "").removeprefix("Bearer ")
+        return int(token.removeprefix("bench-"))
+
+    def message(box: int, index: int) -> dict:
+        return _message(box, index, seed=seed, trial_ratio=trial_ratio, started_ms=started_ms)
+
+    async def gmail_call(name: str):
+        """Latency, then a 429 or None."""
+        calls[name] += 1
+        if latency_ms or jitter_ms:
+            await asyncio.sleep((latency_ms + rng.uniform(0, jitter_ms)) / 1000)
+        if rng.random() < rate_429:
+            calls["429"] += 1
+            return JSONResponse(status_code=429, content={"error": {
+                "code": 429,
+                "message": "Too many concurrent requests for user.",
+                "errors": [{"reason": "rateLimitExceeded"}],
+                "status": "RESOURCE_EXHAUSTED",
+            }})
+        return None
+
+    @app.post("/token")
+    async def token(request: Request):
+        calls["token"] += 1
+        form = parse_qs((await request.body()).decode())
+        return {"access_token": form["refresh_token"][0], "expires_in": 3600, "token_type": "Bearer"}
+
+    @app.get("/gmail/v1/users/me/profile")
+    async def profile(request: Request):
+        return await gmail_call("getProfile") or {"historyId": HISTORY_ID}
+
+    @app.get("/gmail/v1/users/me/messages")
+    async def list_messages(request: Request, q: str = "", maxResults: int = 100, pageToken: str = "0"):
+        error = await gmail_call("messages.list")
+        if error:
+            return error
+        after = re.search(r"after:(\d+)", q)
+        after_ms = int(after.group(1)) * 1000 if after else 0
+        # Newest first: index i was received i hours before server start
+        count = messages
+        if after_ms:
+            count = min(messages, max(0, (started_ms - after_ms - 1) // 3_600_000 + 1))
+        start = int(pageToken)
+        end = min(count, start + maxResults)
+        box = mailbox(request)
+        body = {"messages": [{"id": f"{box:06x}{i:010x}"} for i in range(start, end)], "resultSizeEstimate": count}
+        if end < count:
+            body["nextPageToken"] = str(end)
+        return body
+
+    @app.get("/gmail/v1/users/me/messages/{message_id}")
+    async def get_message(request: Request, message_id: str):
+        return await gmail_call("messages.get") or message(int(message_id[:6], 16), int(message_id[6:], 16))
+
+    @app.get("/gmail/v1/users/me/history")
+    async def history(request: Request):
+        return await gmail_call("history.list") or {"historyId": HISTORY_ID}
+
+    @app.post("/gmail/v1/users/me/watch")
+    async def watch(request: Request):
+        return await gmail_call("watch") or {
+            "historyId": HISTORY_ID,
+            "expiration": str(int(time.time() * 1000) + 7 * 86_400_000),
+        }
+
+    @app.post("/batch/gmail/v1")
+    async def batch(request: Request):
+        error = await gmail_call("batch")
+        if error:
+            return error
+        ids = _BATCH_GET.findall((await request.body()).decode())
+        calls["messages.get"] += len(ids)
+        boundary = "batch_fake_gmail"
+        parts = []
+        for mid in ids:
+            body = JSONResponse(message(int(mid[:6], 16), int(mid[6:], 16))).body.decode()
+            parts.append(
+                f"--{boundary}\r\n"
+                "Content-Type: application/http\r\n"
+                f"Content-ID: <response-{mid}>\r\n\r\n"
+                "HTTP/1.1 200 OK\r\n"
+                "Content-Type: application/json; charset=UTF-8\r\n\r\n"
+                f"{body}\r\n"
+            )
+        parts.append(f"--{boundary}--\r\n")
+        return Response("".join(parts), media_type=f"multipart/mixed; boundary={boundary}")
+
+    @app.get("/_stats")
+    async def stats():
+        return dict(calls)
+
+    return app
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Fake Gmail API for load tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency-ms", type=float, default=40, help="added to every Gmail call")
+    parser.add_argument("--jitter-ms", type=float, default=20, help="random extra latency, up to this")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="share of Gmail calls answered 429")
+    parser.add_argument("--messages", type=int, default=200, help="messages per mailbox")
+    parser.add_argument("--trial-ratio", type=float, default=0.1, help="share of free-trial emails")
+    parser.add_argument("--seed", type=int, default=42)
+    return parser.parse_args()
+
+
+def main():
+    import uvicorn
+
+    args = parse_args()
+    app = create_app(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        rate_429=args.rate_429,
+        messages=args.messages,
+        trial_ratio=args.trial_ratio,
+        seed=args.seed,
+    )
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,418 @@
+# benchmarks/load_test.py
+"""
+Load test: the FastAPI app and the Gmail scanner against a seeded MongoDB
+and a fake Gmail API (benchmarks/fake_gmail.py, started on --gmail-port).
+
+    # a throwaway MongoDB: docker run --rm -p 27017:27017 mongo:7
+    cd backend && python -m benchmarks.load_test --users 200 --trials-per-user 50 \\
+        --concurrency 20 --requests 2000 --save benchmarks/results/main.json
+    # then, on a branch
+    python -m benchmarks.load_test ... --baseline benchmarks/results/main.json
+
+Scenarios (--scenarios, default all of them):
+  me        GET /auth/me                  get_current_user
+  list      GET /trials
+  page      GET /trials?limit=50
+  upcoming  GET /trials/upcoming?days=7,3,1
+  scan      scan_all_users sweep, full Gmail query for every user
+  rescan    second sweep, incremental (history.list)
+
+Requests go to the ASGI app in-process (no HTTP server in between), each with
+the session cookie of a random seeded user; --cold clears the user and trial
+response caches before every request, so each one pays its MongoDB reads.
+For every scenario: p50/p95/p99 latency (per request, or per user scan),
+throughput and MongoDB commands per request / per user, counted by a pymongo
+command listener. The --db-name database is dropped and reseeded every run.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, time as dtime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+import httpx
+from pymongo import monitoring
+
+API_SCENARIOS = {
+    "me": "/auth/me",
+    "list": "/trials",
+    "page": "/trials?limit=50",
+    "upcoming": "/trials/upcoming?days=7,3,1",
+}
+SCAN_SCENARIOS = ["scan", "rescan"]
+SEED_BATCH_SIZE = 5000
+
+# Compared against the baseline; lower is better except throughput
+COMPARED = [("throughput", False), ("p50", True), ("p95", True), ("p99", True), ("mongoOpsPer", True)]
+
+
+class CommandCounter(monitoring.CommandListener):
+    """Counts MongoDB commands by name (called from Motor's worker threads)."""
+
+    def __init__(self):
+        self._counts: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        with self._lock:
+            self._counts[event.command_name] += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+    def snapshot(self) -> Counter:
+        with self._lock:
+            return Counter(self._counts)
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+def summarize(unit: str, latencies_ms: List[float], elapsed: float, ops: Counter, **extra) -> Dict[str, Any]:
+    values = sorted(latencies_ms)
+    count = len(values)
+    total_ops = sum(ops.values())
+    return {
+        "unit": unit,
+        "count": count,
+        "durationS": round(elapsed, 3),
+        "throughput": round(count / elapsed, 1) if elapsed else 0.0,
+        "p50": round(percentile(values, 50), 2),
+        "p95": round(percentile(values, 95), 2),
+        "p99": round(percentile(values, 99), 2),
+        "mean": round(sum(values) / count, 2) if count else 0.0,
+        "max": round(values[-1], 2) if values else 0.0,
+        "mongoOps": dict(ops.most_common()),
+        "mongoOpsPer": round(total_ops / count, 2) if count else 0.0,
+        **extra,
+    }
+
+
+def session_cookie(user_id: str, secret: str) -> str:
+    """The cookie Starlette's SessionMiddleware would set for {"user_id": ...}."""
+    from itsdangerous import TimestampSigner
+
+    data = base64.b64encode(json.dumps({"user_id": user_id}).encode())
+    return TimestampSigner(secret).sign(data).decode()
+
+async def seed(db, *, users: int, trials_per_user: int, rng: random.Random) -> List[str]:
+    """Google users with refresh token bench-<n> (fake Gmail mailbox n), and their trials."""
+    from bson import ObjectId
+    from core.security import encryption
+
+    now = datetime.now(timezone.utc)
+    today = datetime.combine(now.date(), dtime.min, tzinfo=timezone.utc)
+    user_ids = []
+    user_docs = []
+    trial_docs = []
+
+    async def flush():
+        if user_docs:
+            await db.users.insert_many(user_docs)
+            user_docs.clear()
+        if trial_docs:
+            await db.trials.insert_many(trial_docs, ordered=False)
+            trial_docs.clear()
+
+    for n in range(users):
+        user_id = ObjectId()
+        user_ids.append(str(user_id))
+        user_docs.append({
+            "_id": user_id,
+            "provider": "google",
+            "email": f"bench{n}@example.com",
+            "name": f"Bench User {n}",
+            "picture": None,
+            "googleTokens": {"refreshToken": encryption.encrypt(f"bench-{n}")},
+            "createdAt": now,
+        })
+        for t in range(trials_per_user):
+            trial_docs.append({
+                "userId": str(user_id),
+                "serviceName": f"Service {t}",
+                "endDate": today + timedelta(days=rng.randint(-30, 90)),
+                "cancelUrl": rng.choice([None, "https://example.com/cancel"]),
+                "renewalPrice": rng.choice([None, 4.99, 9.99, 14.99]),
+                "status": rng.choice(["detected", "detected", "confirmed", "canceled"]),
+                "createdAt": now,
+                "updatedAt": now,
+            })
+        if len(trial_docs) >= SEED_BATCH_SIZE:
+            await flush()
+    await flush()
+    return user_ids
+
+
+async def run_api_scenario(
+    client: httpx.AsyncClient,
+    path: str,
+    cookies: List[str],
+    counter: CommandCounter,
+    *,
+    requests: int,
+    concurrency: int,
+    cold: bool,
+    rng: random.Random,
+) -> Dict[str, Any]:
+    from core import auth
+    from routes import trials
+
+    latencies: List[float] = []
+    errors: Counter = Counter()
+    todo = iter(range(requests))
+
+    async def worker():
+        for _ in todo:
+            if cold:
+                auth._user_cache.clear()
+                trials._responses.clear()
+            headers = {"Cookie": f"session={rng.choice(cookies)}"}
+            start = time.perf_counter()
+            resp = await client.get(path, headers=headers)
+            latencies.append((time.perf_counter() - start) * 1000)
+            if resp.status_code != 200:
+                errors[str(resp.status_code)] += 1
+
+    before = counter.snapshot()
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return summarize("request", latencies, elapsed, counter.snapshot() - before, errors=dict(errors))
+
+async def run_scan_scenario(
+    counter: CommandCounter,
+    gmail_url: str,
+    *,
+    incremental: bool,
+    concurrency: int,
+    max_messages: int,
+    user_timeout: float,
+) -> Dict[str, Any]:
+    from services.email_monitor.scanner import scan_all_users
+
+    async with httpx.AsyncClient() as http:
+        gmail_before = Counter((await http.get(f"{gmail_url}/_stats")).json())
+        before = counter.snapshot()
+        started = time.perf_counter()
+        totals = await scan_all_users(
+            max_results_per_user=max_messages,
+            concurrency=concurrency,
+            incremental=incremental,
+            per_user_timeout=user_timeout,
+            due_only=False,
+        )
+        elapsed = time.perf_counter() - started
+        ops = counter.snapshot() - before
+        gmail_calls = Counter((await http.get(f"{gmail_url}/_stats")).json()) - gmail_before
+
+    served_429 = gmail_calls.pop("429", 0)
+    return summarize(
+        "user",
+        [s["durationMs"] for s in totals["perUser"]],
+        elapsed,
+        ops,
+        errors=totals["failures"],
+        messages=totals["messages"],
+        created=totals["created"],
+        duplicates=totals["duplicates"],
+        gmailRetries=totals["retries"],
+        gmailThrottledMs=round(totals["throttledMs"], 1),
+        gmailCalls=dict(gmail_calls),
+        gmail429=served_429,
+    )
+
+
+def start_fake_gmail(args) -> subprocess.Popen:
+    proc = subprocess.Popen([
+        sys.executable, "-m", "benchmarks.fake_gmail",
+        "--port", str(args.gmail_port),
+        "--latency-ms", str(args.gmail_latency_ms),
+        "--jitter-ms", str(args.gmail_jitter_ms),
+        "--rate-429", str(args.gmail_429_rate),
+        "--messages", str(args.messages_per_user),
+        "--seed", str(args.seed),
+    ], cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    deadline = time.monotonic() + 15
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f"http://127.0.0.1:{args.gmail_port}/_stats", timeout=1)
+            return proc
+        except httpx.HTTPError:
+            if proc.poll() is not None:
+                break
+            time.sleep(0.2)
+    proc.terminate()
+    raise SystemExit(f"fake Gmail server did not start on port {args.gmail_port}")
+
+
+def print_results(results: Dict[str, Dict[str, Any]]) -> None:
+    print(f"{'scenario':<10} {'unit':<8} {'count':>7} {'per s':>9} {'p50 ms':>9} {'p95 ms':>9} "
+          f"{'p99 ms':>9} {'mongo/unit':>11} {'errors':>7}")
+    for name, r in results.items():
+        print(f"{name:<10} {r['unit']:<8} {r['count']:>7} {r['throughput']:>9.1f} {r['p50']:>9.1f} "
+              f"{r['p95']:>9.1f} {r['p99']:>9.1f} {r['mongoOpsPer']:>11.2f} {sum(r['errors'].values()):>7}")
+
+def print_comparison(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Any]) -> None:
+    print(f"\nvs baseline {baseline['meta'].get('git') or ''} ({baseline['meta']['startedAt']})")
+    for name, r in results.items():
+        old = baseline["scenarios"].get(name)
+        if old is None:
+            continue
+        cells = []
+        for key, lower_is_better in COMPARED:
+            before, after = old.get(key, 0), r[key]
+            change = (after - before) / before * 100 if before else 0.0
+            better = change < 0 if lower_is_better else change > 0
+            mark = "" if abs(change) < 5 else (" better" if better else " WORSE")
+            cells.append(f"{key} {before:g} -> {after:g} ({change:+.0f}%{mark})")
+        print(f"{name:<10} " + " | ".join(cells))
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args) -> Dict[str, Any]:
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from app import app
+    from core.database import close_db, get_db, init_db
+    from core.http_client import close_http_client
+
+    counter = CommandCounter()
+    monitoring.register(counter)
+
+    admin = AsyncIOMotorClient(args.mongo_uri)
+    await admin.drop_database(args.db_name)
+    admin.close()
+    await init_db()
+
+    rng = random.Random(args.seed)
+    db = get_db()
+    started = time.perf_counter()
+    user_ids = await seed(db, users=args.users, trials_per_user=args.trials_per_user, rng=rng)
+    print(f"seeded {args.users} users, {args.users * args.trials_per_user} trials "
+          f"in {time.perf_counter() - started:.1f}s")
+
+    cookies = [session_cookie(user_id, os.environ["SESSION_SECRET"]) for user_id in user_ids]
+    results: Dict[str, Dict[str, Any]] = {}
+    gmail = None
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="https://bench") as client:
+            for name in args.scenarios:
+                if name in API_SCENARIOS:
+                    results[name] = await run_api_scenario(
+                        client, API_SCENARIOS[name], cookies, counter,
+                        requests=args.requests, concurrency=args.concurrency, cold=args.cold, rng=rng,
+                    )
+                    continue
+                if gmail is None:
+                    gmail = start_fake_gmail(args)
+                results[name] = await run_scan_scenario(
+                    counter,
+                    f"http://127.0.0.1:{args.gmail_port}",
+                    incremental=name == "rescan",
+                    concurrency=args.scan_concurrency,
+                    max_messages=args.messages_per_user,
+                    user_timeout=args.user_timeout,
+                )
+    finally:
+        if gmail is not None:
+            gmail.terminate()
+            gmail.wait()
+        close_db()
+        await close_http_client()
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017")
+    parser.add_argument("--db-name", default="free-from-trial-bench",
+                        help="dropped and reseeded on every run; must contain 'bench'")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--trials-per-user", type=int, default=50)
+    parser.add_argument("--scenarios", nargs="+", default=[*API_SCENARIOS, *SCAN_SCENARIOS],
+                        choices=[*API_SCENARIOS, *SCAN_SCENARIOS])
+    parser.add_argument("--requests", type=int, default=2000, help="requests per API scenario")
+    parser.add_argument("--concurrency", type=int, default=20, help="requests in flight")
+    parser.add_argument("--cold", action="store_true", help="clear the user and response caches before each request")
+    parser.add_argument("--scan-concurrency", type=int, default=10, help="users scanned at the same time")
+    parser.add_argument("--user-timeout", type=float, default=60)
+    parser.add_argument("--messages-per-user", type=int, default=200, help="size of each fake mailbox")
+    parser.add_argument("--gmail-port", type=int, default=8090)
+    parser.add_argument("--gmail-latency-ms", type=float, default=40)
+    parser.add_argument("--gmail-jitter-ms", type=float, default=20)
+    parser.add_argument("--gmail-429-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--save", help="write the results (JSON) to this file")
+    parser.add_argument("--baseline", help="results file of an earlier run to compare against")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if "bench" not in args.db_name:
+        raise SystemExit("--db-name must contain 'bench': the database is dropped")
+
+    # Before the app modules are imported: they read their configuration at import
+    os.environ["MONGODB_URI"] = args.mongo_uri
+    os.environ["DB_NAME"] = args.db_name
+    os.environ["GMAIL_API_BASE"] = f"http://127.0.0.1:{args.gmail_port}"
+    os.environ["GOOGLE_TOKEN_URI"] = f"http://127.0.0.1:{args.gmail_port}/token"
+    os.environ.pop("GMAIL_PUBSUB_TOPIC", None)
+    for name, value in {
+        "ENCRYPTION_KEY": "0" * 64,
+        "SESSION_SECRET": "bench-session-secret",
+        "GOOGLE_CLIENT_ID": "bench",
+        "GOOGLE_CLIENT_SECRET": "bench",
+        "GOOGLE_REDIRECT_URI": "http://localhost/oauth/callback",
+        "GUMLOOP_SHARED_SECRET": "bench",
+    }.items():
+        os.environ.setdefault(name, value)
+
+    started_at = datetime.now(timezone.utc).isoformat()
+    results = asyncio.run(run(args))
+    print_results(results)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            print_comparison(results, json.load(f))
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, "w") as f:
+            json.dump({
+                "meta": {
+                    "startedAt": started_at,
+                    "git": git_revision(),
+                    "python": platform.python_version(),
+                    "args": {k: v for k, v in vars(args).items() if k not in ("save", "baseline")},
+                },
+                "scenarios": results,
+            }, f, indent=2)
+        print(f"\nsaved to {args.save}")
+
+
+if __name__ == "__main__":
+    main()
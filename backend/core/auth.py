@@ -1,12 +1,85 @@
+import asyncio
+import os
+from typing import Dict, Optional
+
 from fastapi import Request, HTTPException, status
+from core.cache import TTLCache
 from core.database import get_db
 from bson import ObjectId
 
+# Session user documents, cached per process. Writers call invalidate_user();
+# the TTL bounds staleness for writes made by other processes (cron scanner).
+USER_CACHE_TTL_SECONDS = float(os.environ.get("USER_CACHE_TTL_SECONDS", "60"))
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", "10000"))
+
+# Requests never need the encrypted OAuth tokens
+USER_PROJECTION = {"googleTokens": 0}
+
+_user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL_SECONDS)
+_inflight: Dict[str, asyncio.Task] = {}
+
+async def _fetch_user(user_id: str) -> Optional[dict]:
+    db = get_db()
+    user = await db.users.find_one({"_id": ObjectId(user_id)}, USER_PROJECTION)
+    # invalidate_user() during the query unregisters this fetch: its result
+    # may predate the write, so it is returned but not cached
+    if user and _inflight.get(user_id) is asyncio.current_task():
+        _user_cache.set(user_id, user)
+    return user
+
+def _forget_fetch(user_id: str, task: asyncio.Task) -> None:
+    if _inflight.get(user_id) is task:
+        del _inflight[user_id]
+
+async def load_user(user_id: str) -> Optional[dict]:
+    """
+    Cached users.find_one by id. Concurrent lookups of the same id while it is
+    not cached share a single query.
+    """
+    user = _user_cache.get(user_id)
+    if user is not None:
+        return user
+
+    task = _inflight.get(user_id)
+    if task is None:
+        task = asyncio.ensure_future(_fetch_user(user_id))
+        _inflight[user_id] = task
+        task.add_done_callback(lambda t: _forget_fetch(user_id, t))
+    # shield: one cancelled request must not cancel the query for the others
+    return await asyncio.shield(task)
+
+def invalidate_user(user_id) -> None:
+    """Drop a user from the cache after writing to their document."""
+    user_id = str(user_id)
+    _user_cache.pop(user_id)
+    # Lookups from now on must not share a query that started before the write
+    _inflight.pop(user_id, None)
+
+async def load_trials_version(user_id) -> int:
+    """
+    users.trialsVersion read from MongoDB, not from the user cache: other
+    processes (cron scanner, other workers) bump it without invalidating ours.
+    """
+    db = get_db()
+    doc = await db.users.find_one({"_id": ObjectId(str(user_id))}, {"trialsVersion": 1})
+    return (doc or {}).get("trialsVersion", 0)
+
+async def bump_trials_version(user_id) -> None:
+    """
+    Record that the user's trials changed: `trialsVersion` drives the ETags
+    and cached responses of the trial read routes.
+    """
+    db = get_db()
+    await db.users.update_one({"_id": ObjectId(str(user_id))}, {"$inc": {"trialsVersion": 1}})
+    invalidate_user(user_id)
+
 async def get_current_user(request: Request) -> dict:
     """
     Get authenticated user from session.
     Raises 401 if not authenticated.
     Use as dependency: user = Depends(get_current_user)
+    The returned document is shared through the cache: do not mutate it,
+    and it has no `googleTokens`.
     """
     user_id = request.session.get("user_id")
     
@@ -16,10 +89,9 @@ async def get_current_user(request: Request) -> dict:
             detail="Not authenticated. Please log in."
         )
     
-    # Get user from database
-    db = get_db()
+    # Get user from cache / database
     try:
-        user = await db.users.find_one({"_id": ObjectId(user_id)})
+        user = await load_user(user_id)
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -41,4 +113,4 @@ def create_session(request: Request, user_id: str, email: str):
 
 def destroy_session(request: Request):
     """Destroy user session on logout"""
-    request.session.clear()
\ No newline at end of file
+    request.session.clear()
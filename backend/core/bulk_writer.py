@@ -0,0 +1,132 @@
+# core/bulk_writer.py
+from __future__ import annotations
+import asyncio
+import time
+from typing import Any, Callable, Dict, List, Optional
+from pymongo.errors import BulkWriteError
+
+# Called once per operation after its flush: on_result(upserted, error_code)
+OnResult = Callable[[bool, Optional[int]], None]
+
+
+class BulkWriter:
+    """
+    Buffers write operations (pymongo UpdateOne, InsertOne, ...) for one
+    collection and sends them as unordered bulk_write batches, when `max_ops`
+    operations are queued or the oldest one has waited `max_delay` seconds.
+
+    `flush_first` writers are flushed before this one, so e.g. a user's scan
+    state is never written ahead of the trials it covers.
+    Use as `async with BulkWriter(...) as writer:` to get the timed flushes
+    and a final flush on exit.
+    """
+
+    def __init__(
+        self,
+        collection,
+        *,
+        max_ops: int = 500,
+        max_delay: float = 1.0,
+        flush_first: Optional[List["BulkWriter"]] = None,
+    ):
+        self.collection = collection
+        self.max_ops = max_ops
+        self.max_delay = max_delay
+        self.flush_first = flush_first or []
+        self.stats: Dict[str, int] = {
+            "ops": 0,
+            "flushes": 0,
+            "upserted": 0,
+            "matched": 0,
+            "modified": 0,
+            "errors": 0,
+        }
+        self._ops: List[Any] = []
+        self._callbacks: List[Optional[OnResult]] = []
+        self._oldest: Optional[float] = None
+        self._lock = asyncio.Lock()
+        self._timer: Optional[asyncio.Task] = None
+
+    async def __aenter__(self) -> "BulkWriter":
+        self._timer = asyncio.create_task(self._flush_periodically())
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        await self.flush()
+
+    async def add(self, op: Any, on_result: Optional[OnResult] = None) -> None:
+        self.add_nowait(op, on_result)
+        if len(self._ops) >= self.max_ops:
+            await self.flush()
+
+    def add_nowait(self, op: Any, on_result: Optional[OnResult] = None) -> None:
+        """
+        Queue without ever flushing, for use from another writer's on_result
+        callbacks; the timed or final flush writes it.
+        """
+        if not self._ops:
+            self._oldest = time.monotonic()
+        self._ops.append(op)
+        self._callbacks.append(on_result)
+
+    async def flush(self) -> None:
+        for writer in self.flush_first:
+            await writer.flush()
+
+        # A batch holds other callers' operations too: a caller cancelled
+        # mid-write (a user scan hitting its timeout) must not abort it
+        await asyncio.shield(self._flush())
+
+    async def _flush(self) -> None:
+        # One flush at a time: when flush() returns, everything added before
+        # the call is written, even if another flush was already in flight
+        async with self._lock:
+            if not self._ops:
+                return
+            ops, callbacks = self._ops, self._callbacks
+            self._ops, self._callbacks, self._oldest = [], [], None
+
+            errors: Dict[int, int] = {}
+            try:
+                res = await self.collection.bulk_write(ops, ordered=False)
+                details = res.bulk_api_result
+            except BulkWriteError as e:
+                # Unordered: every other operation was still applied
+                details = e.details
+                errors = {err["index"]: err.get("code") for err in details.get("writeErrors", [])}
+            except BaseException:
+                # Keep the operations for the next flush
+                self._ops[:0], self._callbacks[:0] = ops, callbacks
+                self._oldest = time.monotonic()
+                raise
+
+        upserted = {u["index"] for u in details.get("upserted", [])}
+        self.stats["ops"] += len(ops)
+        self.stats["flushes"] += 1
+        self.stats["upserted"] += len(upserted)
+        self.stats["matched"] += details.get("nMatched", 0)
+        self.stats["modified"] += details.get("nModified", 0)
+        self.stats["errors"] += len(errors)
+
+        for i, callback in enumerate(callbacks):
+            if callback is None:
+                continue
+            try:
+                callback(i in upserted, errors.get(i))
+            except Exception as e:
+                # The write is done: one failing callback must not skip the
+                # others or fail the unrelated caller that flushed
+                print(f"⚠️  bulk write callback on {self.collection.name} failed: {e}")
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.max_delay / 2)
+            if self._oldest is not None and time.monotonic() - self._oldest >= self.max_delay:
+                try:
+                    await self.flush()
+                except Exception as e:
+                    # Operations stay queued; the next tick or the final flush retries
+                    print(f"⚠️  bulk flush to {self.collection.name} failed: {e}")
@@ -5,3 +5,41 @@ DB_NAME = os.environ.get("DB_NAME", "free-from-trial")
 
 if not MONGODB_URI:
     raise RuntimeError("MONGODB_URI is required (set it in DigitalOcean Environment Variables)")
+
+# Gmail scan job: how many users are scanned at once, and how long one user may take
+SCAN_CONCURRENCY = int(os.environ.get("SCAN_CONCURRENCY", "10"))
+SCAN_USER_TIMEOUT_SECONDS = float(os.environ.get("SCAN_USER_TIMEOUT_SECONDS", "60"))
+SCAN_MAX_MESSAGES_PER_USER = int(os.environ.get("SCAN_MAX_MESSAGES_PER_USER", "500"))
+
+# Scanner bulk writes: flush after this many queued operations or this many seconds
+SCAN_BULK_MAX_OPS = int(os.environ.get("SCAN_BULK_MAX_OPS", "500"))
+SCAN_BULK_MAX_DELAY_SECONDS = float(os.environ.get("SCAN_BULK_MAX_DELAY_SECONDS", "1.0"))
+
+# Reminders: channel used when a user has no preferences.alertChannel, and how
+# the dispatcher claims due reminders (batch size, lease, retries)
+REMINDER_DEFAULT_CHANNEL = os.environ.get("REMINDER_DEFAULT_CHANNEL", "log")
+REMINDER_BATCH_SIZE = int(os.environ.get("REMINDER_BATCH_SIZE", "200"))
+REMINDER_LEASE_SECONDS = float(os.environ.get("REMINDER_LEASE_SECONDS", "120"))
+REMINDER_MAX_ATTEMPTS = int(os.environ.get("REMINDER_MAX_ATTEMPTS", "5"))
+REMINDER_POLL_SECONDS = float(os.environ.get("REMINDER_POLL_SECONDS", "30"))
+
+# Scan job queue: a claimed user scan is leased for this long, and failed
+# scans are retried this many times, waiting SCAN_TASK_RETRY_SECONDS * 2^n
+SCAN_TASK_LEASE_SECONDS = float(os.environ.get("SCAN_TASK_LEASE_SECONDS", "300"))
+SCAN_TASK_MAX_ATTEMPTS = int(os.environ.get("SCAN_TASK_MAX_ATTEMPTS", "3"))
+SCAN_TASK_RETRY_SECONDS = float(os.environ.get("SCAN_TASK_RETRY_SECONDS", "60"))
+
+# Adaptive scan schedule (services/email_monitor/scan_schedule.py): a user is
+# rescanned between MIN and MAX seconds after their last scan, and at most
+# SOON seconds later while one of their trials ends within SCAN_TRIAL_SOON_DAYS
+SCAN_INTERVAL_MIN_SECONDS = float(os.environ.get("SCAN_INTERVAL_MIN_SECONDS", "3600"))
+SCAN_INTERVAL_MAX_SECONDS = float(os.environ.get("SCAN_INTERVAL_MAX_SECONDS", "604800"))
+SCAN_INTERVAL_SOON_SECONDS = float(os.environ.get("SCAN_INTERVAL_SOON_SECONDS", "21600"))
+SCAN_TRIAL_SOON_DAYS = int(os.environ.get("SCAN_TRIAL_SOON_DAYS", "3"))
+
+# Gmail push (users.watch): Pub/Sub topic Gmail publishes to (push disabled when
+# unset), and the token the push subscription's endpoint URL carries (?token=...)
+GMAIL_PUBSUB_TOPIC = os.environ.get("GMAIL_PUBSUB_TOPIC")
+GMAIL_PUSH_TOKEN = os.environ.get("GMAIL_PUSH_TOKEN")
+# Watches last 7 days; renew them when less than this is left
+GMAIL_WATCH_RENEW_SECONDS = float(os.environ.get("GMAIL_WATCH_RENEW_SECONDS", "86400"))
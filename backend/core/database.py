@@ -1,21 +1,47 @@
 from motor.motor_asyncio import AsyncIOMotorClient
 from core.config import MONGODB_URI, DB_NAME
+from core.metrics import MongoCommandMetrics
 
 _client: AsyncIOMotorClient | None = None
 _db = None
 
 async def init_db():
     global _client, _db
-    _client = AsyncIOMotorClient(MONGODB_URI)
+    # Command timings for /metrics, by collection and command
+    _client = AsyncIOMotorClient(MONGODB_URI, event_listeners=[MongoCommandMetrics()])
     _db = _client[DB_NAME]
     # Ping + indexes de base
     await _db.command("ping")
     await _db.trials.create_index([("userId", 1), ("status", 1)])
-    await _db.trials.create_index([("userId", 1), ("endDate", 1)])
+    # _id as tie-breaker: keyset pagination of GET /trials sorts on (endDate, _id)
+    await _db.trials.create_index([("userId", 1), ("endDate", 1), ("_id", 1)])
     await _db.trials.create_index(
         [("userId", 1), ("serviceName", 1), ("endDate", 1)],
         unique=True
         )
+    # Reminder schedule: the dispatcher range-scans (status, fireAt); one
+    # reminder per trial, channel and fire time
+    await _db.reminders.create_index([("status", 1), ("fireAt", 1)])
+    await _db.reminders.create_index(
+        [("trialId", 1), ("channel", 1), ("fireAt", 1)],
+        unique=True
+    )
+    # OAuth upserts and Gmail push notifications look users up by email
+    await _db.users.create_index("email")
+    # Scan runs only select users whose gmail.nextScanAt is due
+    await _db.users.create_index("gmail.nextScanAt")
+    # Scan queue (services/email_monitor/scan_queue.py): one active job, one
+    # pending scan per user, and claimable tasks ordered by availableAt
+    await _db.scan_jobs.create_index(
+        "active", unique=True, partialFilterExpression={"active": True}
+    )
+    await _db.scan_tasks.create_index(
+        "userId", unique=True, partialFilterExpression={"active": True}
+    )
+    await _db.scan_tasks.create_index(
+        "availableAt", partialFilterExpression={"active": True}
+    )
+    await _db.scan_tasks.create_index([("jobId", 1), ("status", 1)])
 
 
 def get_db():
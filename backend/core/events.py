@@ -0,0 +1,158 @@
+# core/events.py
+"""
+Per-user trial change events for the /trials/stream SSE endpoint.
+
+Subscribers (one bounded queue per open stream) are grouped by user id.
+Events come from a MongoDB change stream on `trials` when the deployment
+supports one (replica set / Atlas): then writes made by any process, the
+cron scanner included, reach every API process. Otherwise the write paths
+publish directly and only streams served by the writing process see them.
+"""
+from __future__ import annotations
+import asyncio
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, Optional, Set
+from bson import ObjectId
+from pymongo.errors import OperationFailure, PyMongoError
+
+# Events buffered per stream; a client this far behind gets a single
+# "resync" event (reload the list) instead of an unbounded backlog
+STREAM_QUEUE_SIZE = 100
+
+_subscribers: Dict[str, Set[asyncio.Queue]] = {}
+_change_stream_task: Optional[asyncio.Task] = None
+_change_stream_active = False
+_deletes_from_stream = False
+
+
+def _json_ready(doc: dict) -> dict:
+    out = {}
+    for k, v in doc.items():
+        if isinstance(v, ObjectId):
+            v = str(v)
+        elif isinstance(v, datetime):
+            # Dates read back from MongoDB are naive UTC
+            v = (v if v.tzinfo else v.replace(tzinfo=timezone.utc)).isoformat()
+        elif isinstance(v, dict):
+            v = _json_ready(v)
+        out[k] = v
+    return out
+
+def _resync(queue: asyncio.Queue) -> None:
+    while not queue.empty():
+        queue.get_nowait()
+    queue.put_nowait({"type": "resync"})
+
+def _deliver(user_id: str, event: Dict[str, Any]) -> None:
+    for queue in _subscribers.get(user_id, ()):
+        try:
+            queue.put_nowait(event)
+        except asyncio.QueueFull:
+            _resync(queue)
+
+def publish(user_id, event_type: str, trial: dict) -> None:
+    """
+    Called by the write paths after a successful write: created | updated
+    with the full document, deleted with at least its _id. A no-op for what
+    the change stream delivers, so nothing is sent twice.
+    """
+    if _change_stream_active and (event_type != "deleted" or _deletes_from_stream):
+        return
+    _deliver(str(user_id), {"type": event_type, "trial": _json_ready(trial)})
+
+@contextmanager
+def subscribe(user_id) -> Iterator[asyncio.Queue]:
+    queue: asyncio.Queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+    user_id = str(user_id)
+    _subscribers.setdefault(user_id, set()).add(queue)
+    try:
+        yield queue
+    finally:
+        queue_set = _subscribers.get(user_id)
+        if queue_set is not None:
+            queue_set.discard(queue)
+            if not queue_set:
+                del _subscribers[user_id]
+
+_OPERATIONS = {"insert": "created", "replace": "updated", "update": "updated", "delete": "deleted"}
+
+# Reconnect delays after a transient change stream error, doubling up to the max
+CHANGE_STREAM_RETRY_SECONDS = 1.0
+CHANGE_STREAM_RETRY_MAX_SECONDS = 60.0
+
+# OperationFailure codes: standalone server (no change streams at all), and a
+# resume token that fell off the oplog
+_NO_CHANGE_STREAMS = 40573
+_HISTORY_LOST = 286
+
+async def _watch_trials(db) -> None:
+    global _change_stream_active, _deletes_from_stream
+    options = {"full_document": "updateLookup"}
+    try:
+        # Pre-images let deletes be routed to their user (MongoDB 6+);
+        # without them, deletes keep coming from the write paths
+        await db.command("collMod", "trials", changeStreamPreAndPostImages={"enabled": True})
+        options["full_document_before_change"] = "whenAvailable"
+    except PyMongoError:
+        pass
+
+    resume_token = None
+    delay = CHANGE_STREAM_RETRY_SECONDS
+    while True:
+        try:
+            # Resuming replays what was missed while reconnecting. The write
+            # paths published it meanwhile too: the dashboard reloads on any
+            # event, so a repeat costs a 304
+            async with db.trials.watch(resume_after=resume_token, **options) as stream:
+                _change_stream_active = True
+                _deletes_from_stream = "full_document_before_change" in options
+                delay = CHANGE_STREAM_RETRY_SECONDS
+                print("✅ Trial events from MongoDB change stream")
+                async for change in stream:
+                    resume_token = change["_id"]
+                    event_type = _OPERATIONS.get(change["operationType"])
+                    if event_type is None:
+                        continue
+                    if event_type == "deleted":
+                        doc = change.get("fullDocumentBeforeChange")
+                        trial = {"_id": change["documentKey"]["_id"]}
+                    else:
+                        doc = trial = change.get("fullDocument")
+                    if not doc or "userId" not in doc:
+                        continue
+                    _deliver(str(doc["userId"]), {"type": event_type, "trial": _json_ready(trial)})
+        except OperationFailure as e:
+            if e.code == _NO_CHANGE_STREAMS:
+                # Standalone server: no change streams
+                print(f"⚠️  No change streams ({e.code}); trial events from this process's writes only")
+                return
+            if e.code == _HISTORY_LOST:
+                # Events were lost for good: streams reload their list
+                resume_token = None
+                for queues in _subscribers.values():
+                    for queue in queues:
+                        _resync(queue)
+            print(f"⚠️  Trial change stream interrupted: {e}; reconnecting in {delay:.0f}s")
+        except PyMongoError as e:
+            print(f"⚠️  Trial change stream interrupted: {e}; reconnecting in {delay:.0f}s")
+        finally:
+            _change_stream_active = _deletes_from_stream = False
+        # Until then, trial events come from this process's writes only
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, CHANGE_STREAM_RETRY_MAX_SECONDS)
+
+def start_trial_events(db) -> None:
+    global _change_stream_task
+    if _change_stream_task is None:
+        _change_stream_task = asyncio.create_task(_watch_trials(db))
+
+async def stop_trial_events() -> None:
+    global _change_stream_task
+    if _change_stream_task is not None:
+        _change_stream_task.cancel()
+        try:
+            await _change_stream_task
+        except asyncio.CancelledError:
+            pass
+        _change_stream_task = None
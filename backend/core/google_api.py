@@ -0,0 +1,91 @@
+# core/google_api.py
+"""Async calls to Google's OAuth endpoints, on the shared HTTP client."""
+from __future__ import annotations
+import os
+import time
+from typing import Any, Dict, Optional
+import httpx
+
+from core.http_client import get_http_client
+
+GOOGLE_TOKEN_URI = os.environ.get("GOOGLE_TOKEN_URI", "https://oauth2.googleapis.com/token")
+GOOGLE_USERINFO_URI = os.environ.get("GOOGLE_USERINFO_URI", "https://www.googleapis.com/oauth2/v2/userinfo")
+
+
+class GoogleApiError(Exception):
+    """Non-2xx answer from a Google API."""
+
+    def __init__(self, status: int, reason: str = "", message: str = "", retry_after: Optional[float] = None):
+        super().__init__(f"{status} {reason}: {message}".strip())
+        self.status = status
+        self.reason = reason
+        self.message = message
+        self.retry_after = retry_after
+
+
+def raise_for_google_error(resp: httpx.Response) -> None:
+    if resp.status_code < 400:
+        return
+    reason, message = "", resp.text[:200]
+    try:
+        body = resp.json()
+        error = body.get("error")
+        if isinstance(error, dict):
+            message = error.get("message", message)
+            reason = ((error.get("errors") or [{}])[0]).get("reason") or error.get("status", "")
+        elif isinstance(error, str):
+            # OAuth endpoints answer {"error": "invalid_grant", "error_description": ...}
+            reason, message = error, body.get("error_description", "")
+    except ValueError:
+        pass
+    retry_after = resp.headers.get("Retry-After")
+    raise GoogleApiError(
+        resp.status_code,
+        reason,
+        message,
+        float(retry_after) if retry_after and retry_after.isdigit() else None,
+    )
+
+
+def _token_response(body: Dict[str, Any]) -> Dict[str, Any]:
+    expires_in = body.get("expires_in")
+    return {
+        "accessToken": body["access_token"],
+        "refreshToken": body.get("refresh_token"),
+        # ms since epoch, like googleTokens.expiryDate
+        "expiryDate": int((time.time() + expires_in) * 1000) if expires_in else None,
+    }
+
+
+async def exchange_code(code: str, *, client_id: str, client_secret: str, redirect_uri: str) -> Dict[str, Any]:
+    """Exchange an OAuth authorization code for tokens."""
+    resp = await get_http_client().post(GOOGLE_TOKEN_URI, data={
+        "grant_type": "authorization_code",
+        "code": code,
+        "client_id": client_id,
+        "client_secret": client_secret,
+        "redirect_uri": redirect_uri,
+    })
+    raise_for_google_error(resp)
+    return _token_response(resp.json())
+
+
+async def refresh_access_token(refresh_token: str, *, client_id: str, client_secret: str) -> Dict[str, Any]:
+    """Get a new access token from a refresh token."""
+    resp = await get_http_client().post(GOOGLE_TOKEN_URI, data={
+        "grant_type": "refresh_token",
+        "refresh_token": refresh_token,
+        "client_id": client_id,
+        "client_secret": client_secret,
+    })
+    raise_for_google_error(resp)
+    return _token_response(resp.json())
+
+
+async def get_userinfo(access_token: str) -> Dict[str, Any]:
+    resp = await get_http_client().get(
+        GOOGLE_USERINFO_URI,
+        headers={"Authorization": f"Bearer {access_token}"},
+    )
+    raise_for_google_error(resp)
+    return resp.json()
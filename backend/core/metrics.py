@@ -0,0 +1,186 @@
+# core/metrics.py
+"""
+Prometheus metrics: served by GET /metrics (routes/metrics.py) for the API,
+and by `jobs/cron_runner.py --metrics-port` for scan workers.
+Values live in the process: with several uvicorn workers, each one is its
+own scrape target.
+
+Recording is a label lookup and a lock per observation, cheap enough to leave
+on under load. Route labels are templates (/trials/{trial_id}), never raw
+paths, so the number of series stays bounded.
+"""
+from __future__ import annotations
+import asyncio
+import time
+from typing import Dict, Optional, Tuple
+
+from prometheus_client import REGISTRY, Counter, Histogram
+from prometheus_client.core import GaugeMetricFamily
+from pymongo import monitoring
+
+# MongoDB commands and Gmail calls are mostly well under 100 ms
+_FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds",
+    "API requests, until the response starts (headers sent)",
+    ["method", "route", "status"],
+)
+MONGODB_COMMAND_SECONDS = Histogram(
+    "mongodb_command_duration_seconds",
+    "MongoDB commands, by collection and command",
+    ["collection", "command"],
+    buckets=_FAST_BUCKETS,
+)
+MONGODB_COMMAND_ERRORS = Counter(
+    "mongodb_command_errors",
+    "MongoDB commands that failed",
+    ["collection", "command"],
+)
+GMAIL_REQUEST_SECONDS = Histogram(
+    "gmail_request_duration_seconds",
+    "Gmail API calls (one try each), by API method",
+    ["call"],
+    buckets=_FAST_BUCKETS,
+)
+GMAIL_REQUESTS = Counter(
+    "gmail_requests",
+    "Gmail API calls (one try each), by API method and HTTP status",
+    ["call", "code"],
+)
+GMAIL_THROTTLED_SECONDS = Counter(
+    "gmail_throttled_seconds",
+    "Time spent waiting on the Gmail quota rate limiters",
+)
+SCAN_STAGE_SECONDS = Histogram(
+    "scan_stage_duration_seconds",
+    "Gmail scan stages: list (message ids, history), metadata, detect, upsert",
+    ["stage"],
+    buckets=_FAST_BUCKETS,
+)
+EVENT_LOOP_LAG_SECONDS = Histogram(
+    "event_loop_lag_seconds",
+    "How late a periodic sleep wakes up: time the loop spent on other work",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+
+EVENT_LOOP_LAG_INTERVAL_SECONDS = 0.5
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """
+    pymongo command listener (core/database.py). Called from Motor's worker
+    threads; only `started` sees the command, so the collection is kept until
+    the matching `succeeded` / `failed`.
+    """
+
+    def __init__(self):
+        self._collections: Dict[Tuple, str] = {}
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        if not isinstance(collection, str):
+            # getMore names its collection apart; admin commands have none
+            collection = event.command.get("collection", "")
+        self._collections[(event.connection_id, event.request_id)] = collection
+
+    def succeeded(self, event):
+        collection = self._collections.pop((event.connection_id, event.request_id), "")
+        MONGODB_COMMAND_SECONDS.labels(collection, event.command_name).observe(event.duration_micros / 1e6)
+
+    def failed(self, event):
+        collection = self._collections.pop((event.connection_id, event.request_id), "")
+        MONGODB_COMMAND_SECONDS.labels(collection, event.command_name).observe(event.duration_micros / 1e6)
+        MONGODB_COMMAND_ERRORS.labels(collection, event.command_name).inc()
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing every HTTP request by method, route template and status."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        observed = False
+
+        def observe(status: int):
+            nonlocal observed
+            observed = True
+            # The router stores the matched route in the scope
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.labels(
+                scope["method"], getattr(route, "path", "unmatched"), str(status)
+            ).observe(time.perf_counter() - started)
+
+        async def _send(message):
+            if message["type"] == "http.response.start" and not observed:
+                observe(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, _send)
+        except Exception:
+            if not observed:
+                observe(500)
+            raise
+
+
+class _ThreadPoolCollector:
+    """Queue depth and threads of the executors behind asyncio.to_thread / run_in_executor and Motor."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+
+    def collect(self):
+        depth = GaugeMetricFamily("thread_pool_queue_depth", "Calls waiting for a free worker thread", labels=["pool"])
+        threads = GaugeMetricFamily("thread_pool_threads", "Worker threads started", labels=["pool"])
+        for pool, executor in (("default", getattr(self.loop, "_default_executor", None)), ("motor", _motor_executor())):
+            if executor is None:
+                continue
+            depth.add_metric([pool], executor._work_queue.qsize())
+            threads.add_metric([pool], len(executor._threads))
+        yield depth
+        yield threads
+
+def _motor_executor():
+    try:
+        from motor.frameworks import asyncio as motor_asyncio
+    except ImportError:
+        return None
+    return getattr(motor_asyncio, "_EXECUTOR", None)
+
+
+_lag_task: Optional[asyncio.Task] = None
+_pool_collector: Optional[_ThreadPoolCollector] = None
+
+async def _watch_loop_lag(interval: float) -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG_SECONDS.observe(max(0.0, loop.time() - started - interval))
+
+def start_runtime_metrics(interval: float = EVENT_LOOP_LAG_INTERVAL_SECONDS) -> None:
+    """Start sampling event-loop lag, and expose the running loop's thread pools."""
+    global _lag_task, _pool_collector
+    loop = asyncio.get_running_loop()
+    if _pool_collector is None:
+        _pool_collector = _ThreadPoolCollector(loop)
+        REGISTRY.register(_pool_collector)
+    _pool_collector.loop = loop
+    if _lag_task is None:
+        _lag_task = asyncio.create_task(_watch_loop_lag(interval))
+
+async def stop_runtime_metrics() -> None:
+    global _lag_task
+    if _lag_task is not None:
+        _lag_task.cancel()
+        try:
+            await _lag_task
+        except asyncio.CancelledError:
+            pass
+        _lag_task = None
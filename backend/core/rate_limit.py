@@ -0,0 +1,54 @@
+import asyncio
+import random
+import time
+from typing import Optional
+
+
+class TokenBucket:
+    """
+    Async token bucket: `rate` units per second, bursts up to `capacity`.
+    acquire() reserves its units right away and sleeps off the deficit, so
+    waiters are served in arrival order without a lock.
+    Not shared between processes: every worker enforces its own share.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, units: float = 1) -> float:
+        """Take `units`, waiting for them if needed. Returns the seconds waited."""
+        self._refill()
+        self._tokens -= min(units, self.capacity)
+        wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def pause(self, seconds: float) -> None:
+        """Make the next acquire() wait at least `seconds` (the server said slow down)."""
+        self._refill()
+        self._tokens = min(self._tokens, -seconds * self.rate)
+
+
+def backoff_delay(
+    attempt: int,
+    *,
+    base: float = 1.0,
+    cap: float = 32.0,
+    retry_after: Optional[float] = None,
+) -> float:
+    """
+    Seconds to wait before retry number `attempt` (0-based): "full jitter"
+    exponential backoff, or the server's Retry-After plus a little jitter.
+    """
+    if retry_after is not None:
+        return retry_after + random.uniform(0, base)
+    return random.uniform(0, min(cap, base * 2 ** attempt))
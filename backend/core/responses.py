@@ -0,0 +1,35 @@
+# core/responses.py
+"""
+JSON responses encoded by orjson.
+
+orjson writes datetime, date and ObjectId values itself, so handlers can
+return MongoDB documents as they are, skipping FastAPI's jsonable_encoder
+walk. The output is the one JSONResponse gives after jsonable_encoder:
+compact separators, UTF-8, ISO 8601 datetimes (naive ones without an
+offset, as stored by MongoDB). Only the float exponent notation can differ
+(1e-7 vs 1e-07), which is the same JSON number.
+"""
+from typing import Any
+
+import orjson
+from bson import ObjectId
+from fastapi.responses import JSONResponse
+
+
+def _default(v: Any) -> Any:
+    if isinstance(v, ObjectId):
+        return str(v)
+    raise TypeError(f"{type(v).__name__} is not JSON serializable")
+
+def dumps(content: Any) -> bytes:
+    return orjson.dumps(content, default=_default)
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    Drop-in JSONResponse. Returning one from a handler also skips the
+    response_model validation: the model then only documents the shape.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
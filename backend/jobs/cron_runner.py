@@ -1,13 +1,49 @@
 # jobs/cron_runner.py
+import argparse
 import asyncio
-from services.email_monitor.scanner import scan_all_users
+from prometheus_client import start_http_server
+from services.email_monitor.scan_queue import enqueue_scan_job, run_scan_workers
+from core.config import SCAN_CONCURRENCY, SCAN_USER_TIMEOUT_SECONDS, SCAN_MAX_MESSAGES_PER_USER
 from core.database import init_db, close_db
+from core.metrics import start_runtime_metrics, stop_runtime_metrics
+from core.http_client import close_http_client
 
-async def main():
+def parse_args():
+    parser = argparse.ArgumentParser(description="Scan Gmail for every Google user")
+    parser.add_argument("--concurrency", type=int, default=SCAN_CONCURRENCY,
+                        help="number of users scanned at the same time by this process")
+    parser.add_argument("--user-timeout", type=float, default=SCAN_USER_TIMEOUT_SECONDS,
+                        help="seconds before a single user scan is abandoned")
+    parser.add_argument("--full", action="store_true",
+                        help="ignore stored history ids and re-run the full Gmail query")
+    parser.add_argument("--all-users", action="store_true",
+                        help="queue every user, not only those whose next scan is due")
+    parser.add_argument("--worker", action="store_true",
+                        help="do not queue a scan job: keep draining the queue, polling when empty")
+    parser.add_argument("--metrics-port", type=int,
+                        help="serve Prometheus metrics (scan stages, Gmail, MongoDB) on this port")
+    return parser.parse_args()
+
+async def main(args):
+    if args.metrics_port:
+        start_http_server(args.metrics_port)
+        start_runtime_metrics()
     await init_db()
-    stats = await scan_all_users(max_results_per_user=50)
-    print("SCAN DONE:", stats)
-    close_db()
+    try:
+        if not args.worker:
+            job, created = await enqueue_scan_job(
+                max_results=SCAN_MAX_MESSAGES_PER_USER,
+                incremental=not args.full,
+                user_timeout=args.user_timeout,
+                due_only=not args.all_users,
+            )
+            print("SCAN JOB:", job["_id"], "queued" if created else "already running", job.get("total"))
+        stats = await run_scan_workers(args.concurrency, forever=args.worker)
+        print("SCAN DONE:", stats)
+    finally:
+        await stop_runtime_metrics()
+        close_db()
+        await close_http_client()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,48 @@
+# jobs/fake_gmail_push.py
+"""
+Local stand-in for Pub/Sub: POST a Gmail push notification, shaped like the
+real ones, to the push webhook.
+
+    python -m jobs.fake_gmail_push --email me@gmail.com --history-id 123456
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import uuid
+from datetime import datetime, timezone
+import httpx
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Send a fake Gmail push notification")
+    parser.add_argument("--url", default="http://localhost:8080/api/webhooks/gmail/push",
+                        help="push endpoint (without the token)")
+    parser.add_argument("--token", default=os.environ.get("GMAIL_PUSH_TOKEN", ""),
+                        help="push token (default: $GMAIL_PUSH_TOKEN)")
+    parser.add_argument("--email", required=True, help="emailAddress of the changed mailbox")
+    parser.add_argument("--history-id", type=int, required=True, help="mailbox historyId after the change")
+    parser.add_argument("--repeat", type=int, default=1, help="send the same notification N times")
+    return parser.parse_args()
+
+def push_body(email: str, history_id: int) -> dict:
+    data = json.dumps({"emailAddress": email, "historyId": history_id}).encode()
+    return {
+        "message": {
+            "data": base64.b64encode(data).decode(),
+            "messageId": uuid.uuid4().hex,
+            "publishTime": datetime.now(timezone.utc).isoformat(),
+        },
+        "subscription": "projects/local/subscriptions/gmail-push",
+    }
+
+async def main(args):
+    async with httpx.AsyncClient() as client:
+        for _ in range(args.repeat):
+            resp = await client.post(
+                args.url, params={"token": args.token}, json=push_body(args.email, args.history_id)
+            )
+            print(resp.status_code, resp.headers.get("X-Push-Outcome", resp.text))
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,29 @@
+# jobs/reminder_runner.py
+import argparse
+import asyncio
+from services.reminders.dispatcher import dispatch_due, run_dispatcher
+from core.config import REMINDER_BATCH_SIZE, REMINDER_POLL_SECONDS
+from core.database import init_db, close_db
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Send due trial reminders")
+    parser.add_argument("--once", action="store_true",
+                        help="send what is due now and exit (for cron) instead of polling")
+    parser.add_argument("--poll", type=float, default=REMINDER_POLL_SECONDS,
+                        help="seconds between two polls for due reminders")
+    parser.add_argument("--batch-size", type=int, default=REMINDER_BATCH_SIZE,
+                        help="reminders claimed per batch")
+    return parser.parse_args()
+
+async def main(args):
+    await init_db()
+    try:
+        if args.once:
+            print("REMINDERS DONE:", await dispatch_due(batch_size=args.batch_size))
+        else:
+            await run_dispatcher(args.poll, batch_size=args.batch_size)
+    finally:
+        close_db()
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,53 @@
+# routes/gmail_push.py
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+import hmac
+
+from core.config import GMAIL_PUSH_TOKEN, SCAN_MAX_MESSAGES_PER_USER, SCAN_USER_TIMEOUT_SECONDS
+from core.database import get_db
+from services.email_monitor.push import decode_push
+from services.email_monitor.scan_queue import enqueue_user_scan
+from services.email_monitor.scanner import SCANNABLE_USERS
+
+router = APIRouter(prefix="/webhooks", tags=["webhooks"])
+
+async def handle_push(email: str, history_id: int) -> str:
+    """
+    Queue an incremental scan for the user whose mailbox changed.
+    Returns what happened: queued | already_queued | up_to_date | unknown_user.
+    """
+    db = get_db()
+    user = await db.users.find_one({"email": email, **SCANNABLE_USERS}, {"_id": 1, "gmail.historyId": 1})
+    if user is None:
+        return "unknown_user"
+
+    # Notifications can arrive late or twice: skip what a scan already covered
+    scanned = (user.get("gmail") or {}).get("historyId")
+    if scanned and int(scanned) >= history_id:
+        return "up_to_date"
+
+    queued = await enqueue_user_scan(
+        user["_id"],
+        max_results=SCAN_MAX_MESSAGES_PER_USER,
+        incremental=True,
+        user_timeout=SCAN_USER_TIMEOUT_SECONDS,
+    )
+    return "queued" if queued else "already_queued"
+
+@router.post("/gmail/push", status_code=204)
+async def gmail_push(request: Request, token: str = Query(default="")):
+    """
+    Pub/Sub push endpoint for Gmail watch notifications.
+    Any 2xx acks the message, so every well-formed notification is acked,
+    even for unknown users, to avoid redelivery loops.
+    """
+    # 🔒 token from the push subscription URL
+    if not GMAIL_PUSH_TOKEN or not hmac.compare_digest(token, GMAIL_PUSH_TOKEN):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+    try:
+        email, history_id = decode_push(await request.json())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    outcome = await handle_push(email, history_id)
+    return Response(status_code=204, headers={"X-Push-Outcome": outcome})
@@ -1,18 +1,50 @@
 # routes/jobs.py
-from fastapi import APIRouter, HTTPException, Header
+from fastapi import APIRouter, HTTPException, Header, Query
+from bson import ObjectId
 import os
 
-from services.email_monitor.scanner import scan_all_users
+from core.config import SCAN_USER_TIMEOUT_SECONDS, SCAN_MAX_MESSAGES_PER_USER
+from services.email_monitor.scan_queue import enqueue_scan_job, scan_job_status
 
 router = APIRouter(prefix="/jobs", tags=["jobs"])
 
 CRON_SECRET = os.environ.get("CRON_SECRET")
 
-@router.post("/scan-gmail")
-async def job_scan_gmail(x_cron_secret: str = Header(default=None)):
+def check_cron_secret(x_cron_secret: str):
     # Simple protection
     if CRON_SECRET and x_cron_secret != CRON_SECRET:
         raise HTTPException(status_code=401, detail="Unauthorized")
 
-    stats = await scan_all_users(max_results_per_user=50)
-    return {"ok": True, "stats": stats}
+@router.post("/scan-gmail", status_code=202)
+async def job_scan_gmail(
+    x_cron_secret: str = Header(default=None),
+    user_timeout: float = Query(default=SCAN_USER_TIMEOUT_SECONDS, gt=0, le=600),
+    full: bool = False,
+    all_users: bool = False,
+):
+    """
+    Queue a Gmail scan of every user who is due (everyone with `all_users`);
+    `jobs/cron_runner.py --worker` processes (the Procfile's `worker`) do the
+    work: without one running, the job stays queued.
+    While a scan job is still running, its id is returned instead of a new one.
+    """
+    check_cron_secret(x_cron_secret)
+
+    job, created = await enqueue_scan_job(
+        max_results=SCAN_MAX_MESSAGES_PER_USER,
+        incremental=not full,
+        user_timeout=user_timeout,
+        due_only=not all_users,
+    )
+    return {"ok": True, "jobId": str(job["_id"]), "created": created, "total": job.get("total", 0)}
+
+@router.get("/scan-gmail/{job_id}")
+async def job_scan_gmail_status(job_id: str, x_cron_secret: str = Header(default=None)):
+    check_cron_secret(x_cron_secret)
+
+    if not ObjectId.is_valid(job_id):
+        raise HTTPException(status_code=400, detail="Invalid id")
+    status = await scan_job_status(ObjectId(job_id))
+    if status is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return status
@@ -0,0 +1,17 @@
+# routes/metrics.py
+from fastapi import APIRouter, Header, HTTPException, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+import hmac
+import os
+
+router = APIRouter(tags=["metrics"])
+
+# When set, scrapers must send "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics(authorization: str = Header(default="")):
+    """Prometheus text format; see core/metrics.py for what is recorded."""
+    if METRICS_TOKEN and not hmac.compare_digest(authorization, f"Bearer {METRICS_TOKEN}"):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -1,14 +1,13 @@
 from fastapi import APIRouter, Request, HTTPException
 from fastapi.responses import RedirectResponse
-from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import Flow
-from googleapiclient.discovery import build
 from datetime import datetime
 import os
 
 from core.database import get_db
+from core.google_api import GoogleApiError, exchange_code, get_userinfo
 from core.security import encryption, generate_token
-from core.auth import create_session
+from core.auth import create_session, invalidate_user
 
 router = APIRouter(prefix="/oauth", tags=["oauth"])
 
@@ -79,18 +78,22 @@ async def google_oauth_callback(request: Request, code: str, state: str):
     if not stored_state or state != stored_state:
         raise HTTPException(status_code=400, detail="Invalid state parameter. Possible CSRF attack.")
     
-    # Exchange authorization code for tokens
-    flow = get_google_flow()
-    flow.fetch_token(code=code)
-    credentials = flow.credentials
-    
-    # Get user info from Google
-    oauth2_service = build('oauth2', 'v2', credentials=credentials)
-    user_info = oauth2_service.userinfo().get().execute()
+    # Exchange authorization code for tokens (async, never blocks the event loop)
+    try:
+        tokens = await exchange_code(
+            code,
+            client_id=GOOGLE_CLIENT_ID,
+            client_secret=GOOGLE_CLIENT_SECRET,
+            redirect_uri=GOOGLE_REDIRECT_URI,
+        )
+        # Get user info from Google
+        user_info = await get_userinfo(tokens["accessToken"])
+    except GoogleApiError as e:
+        raise HTTPException(status_code=400, detail=f"Google OAuth failed: {e.reason or e.status}")
     
     # Encrypt tokens before storing
-    encrypted_access = encryption.encrypt(credentials.token)
-    encrypted_refresh = encryption.encrypt(credentials.refresh_token)
+    encrypted_access = encryption.encrypt(tokens["accessToken"])
+    encrypted_refresh = encryption.encrypt(tokens["refreshToken"])
     
     # Prepare user document
     user_doc = {
@@ -101,7 +104,7 @@ async def google_oauth_callback(request: Request, code: str, state: str):
         "googleTokens": {
             "accessToken": encrypted_access,
             "refreshToken": encrypted_refresh,
-            "expiryDate": int(credentials.expiry.timestamp() * 1000) if credentials.expiry else None
+            "expiryDate": tokens["expiryDate"]
         },
         "updatedAt": datetime.utcnow()
     }
@@ -130,6 +133,9 @@ async def google_oauth_callback(request: Request, code: str, state: str):
         user = await db.users.find_one({"email": user_info["email"]})
         user_id = str(user["_id"])
     
+    # Cached copies of this user are stale now
+    invalidate_user(user_id)
+
     # Create session
     create_session(request, user_id, user_info["email"])
     
@@ -1,13 +1,26 @@
-from fastapi import APIRouter, HTTPException, Depends
-from pydantic import BaseModel, Field
+from fastapi import APIRouter, HTTPException, Depends, Header, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, ConfigDict, Field, ValidationError
 from datetime import datetime, date
-from typing import Optional
+from typing import Any, Dict, List, Literal, Optional, Tuple
 from bson import ObjectId
+import asyncio
+import base64
+import csv
+import hashlib
+import io
+import json
+import os
+import re
 from datetime import datetime, date, time, timezone, timedelta
-from core.auth import get_current_user
+from core.auth import bump_trials_version, get_current_user, load_trials_version
+from core.cache import TTLCache
+from core import events
 from core.database import get_db
+from core.responses import FastJSONResponse, dumps
+from services.reminders.scheduler import drop_trial_reminders, sync_reminders, sync_trial_reminders
 
-router = APIRouter(prefix="/trials", tags=["trials"])
+router = APIRouter(prefix="/trials", tags=["trials"], default_response_class=FastJSONResponse)
 
 class TrialCreate(BaseModel):
     serviceName: str
@@ -22,9 +35,38 @@ class TrialUpdate(BaseModel):
     renewalPrice: Optional[float] = None
     status: Optional[str] = None  # detected|confirmed|canceled|expired
 
-def to_str_id(doc):
-    doc["_id"] = str(doc["_id"])
-    return doc
+# Response models document the shapes (OpenAPI). Handlers return documents
+# already encoded by FastJSONResponse, so they are not validated per row.
+class TrialOut(BaseModel):
+    """A trial; scanner trials also carry source, currency, links. `fields` narrows it."""
+    model_config = ConfigDict(extra="allow")
+
+    id: str = Field(alias="_id")
+    endDate: datetime
+    userId: Optional[str] = None
+    serviceName: Optional[str] = None
+    cancelUrl: Optional[str] = None
+    renewalPrice: Optional[float] = None
+    status: Optional[str] = None  # detected|confirmed|canceled|expired
+    daysLeft: Optional[int] = None  # lists only
+    createdAt: Optional[datetime] = None
+    updatedAt: Optional[datetime] = None
+
+class ReminderOut(BaseModel):
+    trialId: str
+    userId: str
+    serviceName: Optional[str] = None
+    endDate: datetime
+    daysLeft: int
+    cancelUrl: Optional[str] = None
+    renewalPrice: Optional[float] = None
+    status: str
+
+class UpcomingReminders(BaseModel):
+    userId: str
+    targets: List[int]
+    count: int
+    reminders: List[ReminderOut]
 
 def date_to_datetime_utc(d: date) -> datetime:
     # Stocke à minuit UTC (tu peux changer si tu veux l’heure locale)
@@ -36,11 +78,10 @@ def oid(s: str) -> ObjectId:
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid id")
 
-from pymongo.errors import DuplicateKeyError
+from pymongo import DeleteOne, InsertOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 
-@router.post("")
-async def create_trial(payload: TrialCreate, user: dict = Depends(get_current_user)):
-    db = get_db()
+def new_trial_doc(payload: TrialCreate, user: dict) -> dict:
     doc = payload.model_dump()
 
     # ✅ userId vient de la session
@@ -51,22 +92,45 @@ async def create_trial(payload: TrialCreate, user: dict = Depends(get_current_us
     doc["status"] = "detected"
     doc["createdAt"] = now
     doc["updatedAt"] = now
+    return doc
+
+def trial_updates(patch: TrialUpdate) -> dict:
+    """$set fields for a PATCH: only the fields that were sent."""
+    updates = {k: v for k, v in patch.model_dump().items() if v is not None}
+    if "endDate" in updates:
+        updates["endDate"] = date_to_datetime_utc(updates["endDate"])
+    updates["updatedAt"] = datetime.now(timezone.utc)
+    return updates
+
+@router.post("", response_model=TrialOut)
+async def create_trial(payload: TrialCreate, user: dict = Depends(get_current_user)):
+    db = get_db()
+    doc = new_trial_doc(payload, user)
 
     try:
-        res = await db.trials.insert_one(doc)
+        await db.trials.insert_one(doc)
     except DuplicateKeyError:
         raise HTTPException(status_code=409, detail="Trial already exists for this date.")
 
-    doc["_id"] = str(res.inserted_id)
-    return doc
-
-@router.get("")
-async def list_trials(
-    user: dict = Depends(get_current_user),
-    status: Optional[str] = None,
-    days: Optional[int] = None
-):
-    db = get_db()
+    await sync_trial_reminders(db, doc, user)
+    await bump_trials_version(user["_id"])
+    events.publish(user["_id"], "created", doc)
+    return FastJSONResponse(doc)
+
+DAY_MS = 86_400_000
+
+def days_left_expr(now: datetime) -> dict:
+    """
+    Aggregation expression for daysLeft: whole days until endDate, rounded up,
+    never negative. Same value as max(0, (seconds + 86399) // 86400) in Python.
+    """
+    return {"$toInt": {"$max": [0, {"$floor": {"$divide": [
+        {"$add": [{"$subtract": ["$endDate", now]}, DAY_MS - 1000]},
+        DAY_MS,
+    ]}}]}}
+
+def trials_filter(user: dict, status: Optional[str] = None, days: Optional[int] = None) -> dict:
+    """Ownership filter for the session user, plus the optional list filters."""
     q = {"userId": str(user["_id"])}
 
     if status:
@@ -80,31 +144,343 @@ async def list_trials(
         until = now + timedelta(days=days)
         q["endDate"] = {"$gte": now, "$lte": until}
 
-    out = []
-    now = datetime.now(timezone.utc)
-
-    async for doc in db.trials.find(q).sort("endDate", 1):
-        doc["_id"] = str(doc["_id"])
-
-        end_date = doc["endDate"]
-        if end_date.tzinfo is None:
-            end_date = end_date.replace(tzinfo=timezone.utc)
-
-        delta = end_date - now
-        doc["daysLeft"] = max(0, int((delta.total_seconds() + 86399) // 86400))
-        out.append(doc)
+    return q
 
-    return out
+TRIALS_PAGE_MAX = 500
+_FIELD_NAME = re.compile(r"^[A-Za-z][A-Za-z0-9_]*(\.[A-Za-z0-9_]+)*$")
 
+def encode_cursor(doc: dict) -> str:
+    """Opaque keyset cursor: position just after `doc` in (endDate, _id) order."""
+    end_date = doc["endDate"]
+    if end_date.tzinfo is None:
+        end_date = end_date.replace(tzinfo=timezone.utc)
+    raw = json.dumps({"e": int(end_date.timestamp() * 1000), "i": str(doc["_id"])})
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
 
-@router.get("/upcoming")
+def decode_cursor(cursor: str) -> Tuple[datetime, ObjectId]:
+    try:
+        raw = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return datetime.fromtimestamp(raw["e"] / 1000, tz=timezone.utc), ObjectId(raw["i"])
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def parse_fields(fields: Optional[str]) -> Optional[List[str]]:
+    if not fields:
+        return None
+    names = [f.strip() for f in fields.split(",") if f.strip()]
+    if not names or len(names) > 50 or not all(_FIELD_NAME.match(f) for f in names):
+        raise HTTPException(status_code=400, detail="Invalid fields. Use CSV like 'serviceName,endDate'")
+    names = list(dict.fromkeys(names))
+    # "links" with "links.gmailMessageId" is a path collision in $project;
+    # _id and endDate are always projected
+    projected = set(names) | {"_id", "endDate"}
+    for name in names:
+        parts = name.split(".")
+        if any(".".join(parts[:i]) in projected for i in range(1, len(parts))):
+            raise HTTPException(status_code=400, detail=f"Invalid fields: '{name}' overlaps another requested field")
+    return names
+
+# Conditional reads. users.trialsVersion is bumped by every write to a user's
+# trials (routes, Gumloop webhook, scanner) and read fresh by every request
+# (an _id lookup projected on it), so (user, version, UTC day, query)
+# identifies a read's response: daysLeft and the "from now" filters only move
+# at UTC midnight, since endDates are stored at midnight UTC. Responses are
+# cached per process under that key, and If-None-Match gets a 304.
+TRIALS_RESPONSE_CACHE_SIZE = int(os.environ.get("TRIALS_RESPONSE_CACHE_SIZE", "2000"))
+TRIALS_RESPONSE_CACHE_TTL_SECONDS = float(os.environ.get("TRIALS_RESPONSE_CACHE_TTL_SECONDS", "300"))
+
+_responses = TTLCache(maxsize=TRIALS_RESPONSE_CACHE_SIZE, ttl=TRIALS_RESPONSE_CACHE_TTL_SECONDS)
+
+async def trials_version(user: dict) -> int:
+    # Fresh on every read: the cached user's copy misses other processes' writes
+    return await load_trials_version(user["_id"])
+
+def _etags(header: str) -> List[str]:
+    """Entity tags of an If-Match / If-None-Match header, without W/ prefixes."""
+    tags = []
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag:
+            tags.append(tag)
+    return tags
+
+async def read_key(user: dict, *parts) -> tuple:
+    version = await trials_version(user)
+    now = datetime.now(timezone.utc)
+    return (str(user["_id"]), version, now.date().isoformat(), *parts)
+
+def read_etag(key: tuple) -> str:
+    return '"' + hashlib.sha1(repr(key).encode()).hexdigest()[:24] + '"'
+
+async def cached_read(if_none_match: Optional[str], key: tuple, compute, etag: Optional[str] = None) -> Response:
+    """
+    Answer a trial read from the response cache when possible.
+    `compute()` returns (body, etag, headers); the body is cached encoded, so
+    a hit costs no serialization. An `etag` known up front lets If-None-Match
+    be answered without computing anything.
+    """
+    def matches(tag: str) -> bool:
+        if if_none_match is None:
+            return False
+        return if_none_match.strip() == "*" or tag in _etags(if_none_match)
+
+    if etag is not None and matches(etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "private, no-cache"})
+
+    entry = _responses.get(key)
+    if entry is None:
+        body, etag, headers = await compute()
+        entry = dumps(body), etag, headers
+        now = datetime.now(timezone.utc)
+        midnight = datetime.combine(now.date() + timedelta(days=1), time.min, tzinfo=timezone.utc)
+        _responses.set(key, entry, ttl=min(TRIALS_RESPONSE_CACHE_TTL_SECONDS, (midnight - now).total_seconds()))
+    body, etag, headers = entry
+
+    # Browsers revalidate with If-None-Match instead of reusing silently
+    headers = {**headers, "ETag": etag, "Cache-Control": "private, no-cache"}
+    if matches(etag):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type=FastJSONResponse.media_type, headers=headers)
+
+BATCH_MAX_OPERATIONS = 1000
+
+class TrialBatchOperation(BaseModel):
+    op: Literal["create", "update", "delete"]
+    id: Optional[str] = None
+    data: Optional[Dict[str, Any]] = None
+
+class TrialBatch(BaseModel):
+    operations: List[Any] = Field(max_length=BATCH_MAX_OPERATIONS)
+
+def _invalid(index: int, op: Optional[str], detail: str) -> dict:
+    return {"index": index, "op": op, "status": "invalid", "detail": detail}
+
+@router.post("/batch")
+async def batch_trials(payload: TrialBatch, user: dict = Depends(get_current_user)):
+    """
+    Apply many create / update / delete operations in one unordered bulk_write.
+    Body: {"operations": [{"op": "create", "data": {...}},
+                          {"op": "update", "id": "...", "data": {...}},
+                          {"op": "delete", "id": "..."}]}
+    Returns one result per operation, in request order, with a status of
+    created | updated | deleted | duplicate | not_found | invalid.
+    A trial may appear only once per batch (bulk order is not guaranteed).
+    """
+    db = get_db()
+    user_id = str(user["_id"])
+    results: List[Optional[dict]] = [None] * len(payload.operations)
+
+    # Validate every item on its own: one bad row must not reject the batch
+    parsed: List[Tuple[int, TrialBatchOperation, Any, Optional[ObjectId]]] = []
+    seen_ids = set()
+    for i, raw in enumerate(payload.operations):
+        try:
+            item = TrialBatchOperation.model_validate(raw)
+            if item.op == "create":
+                parsed.append((i, item, TrialCreate.model_validate(item.data or {}), None))
+                continue
+            if not item.id or not ObjectId.is_valid(item.id):
+                results[i] = _invalid(i, item.op, "Invalid id")
+                continue
+            if item.id in seen_ids:
+                results[i] = _invalid(i, item.op, "Trial appears more than once in the batch")
+                continue
+            seen_ids.add(item.id)
+            data = TrialUpdate.model_validate(item.data or {}) if item.op == "update" else None
+            parsed.append((i, item, data, ObjectId(item.id)))
+        except ValidationError as e:
+            err = e.errors()[0]
+            where = ".".join(str(p) for p in err["loc"])
+            detail = f"{where}: {err['msg']}" if where else err["msg"]
+            results[i] = _invalid(i, raw.get("op") if isinstance(raw, dict) else None, detail)
+
+    # Ownership of every targeted trial, in a single query
+    target_ids = [trial_id for _, _, _, trial_id in parsed if trial_id is not None]
+    owned = set()
+    if target_ids:
+        async for doc in db.trials.find({"_id": {"$in": target_ids}, "userId": user_id}, {"_id": 1}):
+            owned.add(doc["_id"])
+
+    ops = []
+    op_items: List[Tuple[int, str, str]] = []  # bulk index -> (request index, op, trial id)
+    created: Dict[str, dict] = {}
+    for i, item, data, trial_id in parsed:
+        if item.op == "create":
+            doc = new_trial_doc(data, user)
+            doc["_id"] = ObjectId()
+            ops.append(InsertOne(doc))
+            created[str(doc["_id"])] = doc
+            op_items.append((i, "create", str(doc["_id"])))
+            continue
+        if trial_id not in owned:
+            results[i] = {"index": i, "op": item.op, "status": "not_found", "id": item.id}
+            continue
+        if item.op == "update":
+            ops.append(UpdateOne({"_id": trial_id, "userId": user_id}, {"$set": trial_updates(data)}))
+        else:
+            ops.append(DeleteOne({"_id": trial_id, "userId": user_id}))
+        op_items.append((i, item.op, item.id))
+
+    errors: Dict[int, int] = {}
+    matched = 0
+    if ops:
+        try:
+            res = await db.trials.bulk_write(ops, ordered=False)
+            matched = res.matched_count
+        except BulkWriteError as e:
+            errors = {err["index"]: err.get("code") for err in e.details.get("writeErrors", [])}
+            matched = e.details.get("nMatched", 0)
+
+    # Re-schedule reminders of every written trial: one find for the updated
+    # ones, one bulk_write for all of them
+    written = {op: [] for op in ("create", "update", "delete")}
+    missing = set()
+    for bulk_index, (i, op, trial_id) in enumerate(op_items):
+        if bulk_index not in errors:
+            written[op].append(trial_id)
+    trials = [created[trial_id] for trial_id in written["create"]]
+    if written["update"]:
+        updated = await db.trials.find(
+            {"_id": {"$in": [ObjectId(t) for t in written["update"]]}, "userId": user_id}
+        ).to_list(None)
+        trials += updated
+        if matched < len(written["update"]):
+            # Some trials were deleted after the ownership check: their
+            # update matched nothing, and they are not read back either
+            found = {str(t["_id"]) for t in updated}
+            missing = {t for t in written["update"] if t not in found}
+            written["update"] = [t for t in written["update"] if t in found]
+    await sync_reminders(db, trials, {user_id: user})
+    await drop_trial_reminders(db, written["delete"])
+    if any(written.values()):
+        await bump_trials_version(user_id)
+    for trial in trials:
+        events.publish(user_id, "created" if str(trial["_id"]) in created else "updated", trial)
+    for trial_id in written["delete"]:
+        events.publish(user_id, "deleted", {"_id": trial_id})
+
+    done = {"create": "created", "update": "updated", "delete": "deleted"}
+    for bulk_index, (i, op, trial_id) in enumerate(op_items):
+        code = errors.get(bulk_index, "ok")
+        if code == "ok" and op == "update" and trial_id in missing:
+            status = "not_found"
+        elif code == "ok":
+            status = done[op]
+        elif code == 11000:
+            status = "duplicate"
+        else:
+            status = "invalid"
+        if op == "create" and status != "created":
+            trial_id = None
+        results[i] = {"index": i, "op": op, "status": status, "id": trial_id}
+
+    counts: Dict[str, int] = {}
+    for r in results:
+        counts[r["status"]] = counts.get(r["status"], 0) + 1
+    return {"counts": counts, "results": results}
+
+@router.get("", response_model=List[TrialOut])
+async def list_trials(
+    user: dict = Depends(get_current_user),
+    status: Optional[str] = None,
+    days: Optional[int] = None,
+    limit: Optional[int] = Query(default=None, ge=1, le=TRIALS_PAGE_MAX),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    if_none_match: Optional[str] = Header(default=None),
+):
+    """
+    Trials sorted by (endDate, _id).
+    Paginated when `limit` or `cursor` is given: at most `limit` trials
+    (default and max TRIALS_PAGE_MAX), and the `X-Next-Cursor` response header
+    carries the cursor of the next page when there is one. Keyset pagination
+    on the (userId, endDate, _id) index, so deep pages cost the same as the first.
+    `fields` (CSV) limits the returned fields; `_id` and `endDate` always come back.
+    Sends an ETag; a matching If-None-Match gets a 304 after a single read of
+    the user's trialsVersion.
+    """
+    key = await read_key(user, "list", status, days, limit, cursor, fields)
+    etag = read_etag(key)
+
+    async def compute():
+        out, headers = await _list_trials(user, status, days, limit, cursor, fields)
+        return out, etag, headers
+
+    return await cached_read(if_none_match, key, compute, etag)
+
+async def _list_trials(
+    user: dict,
+    status: Optional[str],
+    days: Optional[int],
+    limit: Optional[int],
+    cursor: Optional[str],
+    fields: Optional[str],
+) -> Tuple[List[dict], Dict[str, str]]:
+    db = get_db()
+    q = trials_filter(user, status, days)
+    now = datetime.now(timezone.utc)
+    selected = parse_fields(fields)
+
+    paginated = limit is not None or cursor is not None
+    if paginated:
+        limit = limit or TRIALS_PAGE_MAX
+    if cursor:
+        after_end, after_id = decode_cursor(cursor)
+        q["$or"] = [
+            {"endDate": {"$gt": after_end}},
+            {"endDate": after_end, "_id": {"$gt": after_id}},
+        ]
+
+    pipeline = [
+        {"$match": q},
+        {"$sort": {"endDate": 1, "_id": 1}},
+    ]
+    if paginated:
+        # One extra row tells whether there is a next page
+        pipeline.append({"$limit": limit + 1})
+    if selected is not None:
+        pipeline.append({"$project": {
+            "_id": 1,
+            "endDate": 1,
+            **{f: 1 for f in selected if f not in ("_id", "endDate", "daysLeft")},
+        }})
+
+    # _id stringified and daysLeft computed by MongoDB, no per-document Python work
+    computed = {"_id": {"$toString": "$_id"}}
+    if selected is None or "daysLeft" in selected:
+        computed["daysLeft"] = days_left_expr(now)
+    pipeline.append({"$addFields": computed})
+
+    out = await db.trials.aggregate(pipeline).to_list(length=None)
+
+    headers = {}
+    if paginated and len(out) > limit:
+        out = out[:limit]
+        headers["X-Next-Cursor"] = encode_cursor(out[-1])
+
+    return out, headers
+
+
+@router.get("/upcoming", response_model=UpcomingReminders)
 async def upcoming_reminders(
     days: str = "5,3,1",
     include_today: bool = False,
     include_canceled: bool = False,
-    user: dict = Depends(get_current_user)  # ✅ ADD THIS
+    user: dict = Depends(get_current_user),  # ✅ ADD THIS
+    if_none_match: Optional[str] = Header(default=None),
 ):
     """Retourne les trials à notifier à J-5/J-3/J-1"""
+    key = await read_key(user, "upcoming", days, include_today, include_canceled)
+    etag = read_etag(key)
+
+    async def compute():
+        return await _upcoming_reminders(user, days, include_today, include_canceled), etag, {}
+
+    return await cached_read(if_none_match, key, compute, etag)
+
+async def _upcoming_reminders(user: dict, days: str, include_today: bool, include_canceled: bool) -> dict:
     db = get_db()
     now = datetime.now(timezone.utc)
 
@@ -130,26 +506,39 @@ async def upcoming_reminders(
     if not include_canceled:
         q["status"] = {"$nin": ["canceled", "expired"]}
 
+    # Only the reminder fields, and only rows whose daysLeft is a target, leave MongoDB
+    pipeline = [
+        {"$match": q},
+        {"$sort": {"endDate": 1}},
+        {"$project": {
+            "_id": 0,
+            "trialId": {"$toString": "$_id"},
+            "userId": 1,
+            "serviceName": 1,
+            "endDate": 1,
+            "daysLeft": days_left_expr(now),
+            "cancelUrl": 1,
+            "renewalPrice": 1,
+            "status": 1,
+        }},
+        {"$match": {"daysLeft": {"$in": targets}}},
+    ]
+
     out = []
-    async for doc in db.trials.find(q).sort("endDate", 1):
-        doc["_id"] = str(doc["_id"])
+    async for doc in db.trials.aggregate(pipeline):
         end_date = doc["endDate"]
         if end_date.tzinfo is None:
             end_date = end_date.replace(tzinfo=timezone.utc)
-        delta = end_date - now
-        days_left = max(0, int((delta.total_seconds() + 86399) // 86400))
-
-        if days_left in targets:
-            out.append({
-                "trialId": doc["_id"],
-                "userId": doc["userId"],
-                "serviceName": doc.get("serviceName"),
-                "endDate": end_date.isoformat(),
-                "daysLeft": days_left,
-                "cancelUrl": doc.get("cancelUrl"),
-                "renewalPrice": doc.get("renewalPrice"),
-                "status": doc.get("status", "detected"),
-            })
+        out.append({
+            "trialId": doc["trialId"],
+            "userId": doc["userId"],
+            "serviceName": doc.get("serviceName"),
+            "endDate": end_date.isoformat(),
+            "daysLeft": doc["daysLeft"],
+            "cancelUrl": doc.get("cancelUrl"),
+            "renewalPrice": doc.get("renewalPrice"),
+            "status": doc.get("status", "detected"),
+        })
 
     return {
         "userId": str(user["_id"]),  # ✅ USE AUTHENTICATED USER
@@ -158,48 +547,209 @@ async def upcoming_reminders(
         "reminders": out
     }
 
-@router.get("/{trial_id}")
-async def get_trial(
-    trial_id: str,
-    user: dict = Depends(get_current_user)  # ✅ ADD THIS
+EXPORT_BATCH_SIZE = 500
+EXPORT_CSV_COLUMNS = [
+    "_id", "serviceName", "endDate", "daysLeft", "status", "renewalPrice",
+    "currency", "cancelUrl", "source", "createdAt", "updatedAt",
+]
+
+def _export_value(v):
+    if isinstance(v, datetime):
+        return v.isoformat()
+    if isinstance(v, ObjectId):
+        return str(v)
+    raise TypeError(f"{type(v).__name__} is not JSON serializable")
+
+async def _export_chunks(cursor, fmt: str):
+    """
+    Encode documents as they come off the Motor cursor, one chunk per batch.
+    StreamingResponse awaits each send, so a slow client pauses the cursor
+    instead of letting documents pile up in memory.
+    """
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    if fmt == "csv":
+        writer.writerow(EXPORT_CSV_COLUMNS)
+
+    n = 0
+    async for doc in cursor:
+        if fmt == "csv":
+            writer.writerow([
+                _export_value(v) if isinstance(v, (datetime, ObjectId)) else v
+                for v in (doc.get(c) for c in EXPORT_CSV_COLUMNS)
+            ])
+        else:
+            buf.write(json.dumps(doc, default=_export_value))
+            buf.write("\n")
+        n += 1
+        if n % EXPORT_BATCH_SIZE == 0:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+
+    if buf.tell():
+        yield buf.getvalue()
+
+STREAM_HEARTBEAT_SECONDS = 20
+
+async def _stream_events(request: Request, user_id: str):
+    with events.subscribe(user_id) as queue:
+        # Tell the browser how long to wait before reconnecting
+        yield "retry: 5000\n\n"
+        while not await request.is_disconnected():
+            try:
+                event = await asyncio.wait_for(queue.get(), STREAM_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                # Comment line: keeps proxies from closing an idle connection
+                yield ": ping\n\n"
+                continue
+            yield f"event: {event['type']}\ndata: {json.dumps(event.get('trial'))}\n\n"
+
+@router.get("/stream")
+async def stream_trials(request: Request, user: dict = Depends(get_current_user)):
+    """
+    Server-Sent Events: `created` / `updated` / `deleted` events carrying the
+    trial (just its _id for deletes), and `resync` when the client fell too
+    far behind and should reload GET /trials. See core/events.py.
+    """
+    return StreamingResponse(
+        _stream_events(request, str(user["_id"])),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.get("/export")
+async def export_trials(
+    user: dict = Depends(get_current_user),
+    format: str = Query(default="ndjson", pattern="^(ndjson|csv)$"),
+    status: Optional[str] = None,
+    days: Optional[int] = None,
 ):
+    """
+    Stream every matching trial as NDJSON (one document per line) or CSV,
+    with constant memory whatever the number of trials.
+    Same filters, ownership check and daysLeft as GET /trials.
+    """
     db = get_db()
-    doc = await db.trials.find_one({
-        "_id": oid(trial_id),
-        "userId": str(user["_id"])  # ✅ VERIFY OWNERSHIP
-    })
-    if not doc:
-        raise HTTPException(404, "Trial not found")
-    return to_str_id(doc)
+    q = trials_filter(user, status, days)
+    now = datetime.now(timezone.utc)
+
+    pipeline = [
+        {"$match": q},
+        {"$sort": {"endDate": 1, "_id": 1}},
+        {"$addFields": {"_id": {"$toString": "$_id"}, "daysLeft": days_left_expr(now)}},
+    ]
+    cursor = db.trials.aggregate(pipeline, batchSize=EXPORT_BATCH_SIZE)
+
+    if format == "csv":
+        media_type, ext = "text/csv; charset=utf-8", "csv"
+    else:
+        media_type, ext = "application/x-ndjson", "ndjson"
+    return StreamingResponse(
+        _export_chunks(cursor, format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="trials.{ext}"'},
+    )
+
+def trial_version(doc: dict) -> datetime:
+    """
+    updatedAt, or for documents written without one (older or external
+    writers) createdAt, then the _id creation time.
+    """
+    version = doc.get("updatedAt") or doc.get("createdAt") or ObjectId(str(doc["_id"])).generation_time
+    if version.tzinfo is None:
+        version = version.replace(tzinfo=timezone.utc)
+    return version
+
+def trial_etag(doc: dict) -> str:
+    """Strong ETag of one trial: its version (trial_version), in ms (the precision MongoDB keeps)."""
+    return f'"{int(trial_version(doc).timestamp() * 1000)}"'
+
+def if_match_versions(if_match: str) -> List[datetime]:
+    """updatedAt values accepted by an If-Match header; [] if none is one of our ETags."""
+    out = []
+    for tag in _etags(if_match):
+        try:
+            out.append(datetime.fromtimestamp(int(tag.strip('"')) / 1000, tz=timezone.utc))
+        except ValueError:
+            continue
+    return out
 
-@router.patch("/{trial_id}")
+def if_match_filter(trial_id: ObjectId, if_match: str) -> dict:
+    """Filter matching the trial only while its version is one the If-Match header names."""
+    versions = if_match_versions(if_match)
+    alternatives = [
+        {"updatedAt": {"$in": versions}},
+        {"updatedAt": None, "createdAt": {"$in": versions}},
+    ]
+    if trial_id.generation_time in versions:
+        alternatives.append({"updatedAt": None, "createdAt": None})
+    return {"$or": alternatives}
+
+@router.get("/{trial_id}", response_model=TrialOut)
+async def get_trial(
+    trial_id: str,
+    user: dict = Depends(get_current_user),  # ✅ ADD THIS
+    if_none_match: Optional[str] = Header(default=None),
+):
+    """
+    The ETag is the trial's version (see trial_etag), as If-Match on PATCH expects.
+    Cached per trials version, so a repeated If-None-Match gets a 304 after a
+    single read of the user's trialsVersion.
+    """
+    async def compute():
+        db = get_db()
+        doc = await db.trials.find_one({
+            "_id": oid(trial_id),
+            "userId": str(user["_id"])  # ✅ VERIFY OWNERSHIP
+        })
+        if not doc:
+            raise HTTPException(404, "Trial not found")
+        return doc, trial_etag(doc), {}
+
+    return await cached_read(if_none_match, await read_key(user, "trial", trial_id), compute)
+
+@router.patch("/{trial_id}", response_model=TrialOut)
 async def update_trial(
     trial_id: str,
     patch: TrialUpdate,
-    user: dict = Depends(get_current_user)  # ✅ ADD THIS
+    user: dict = Depends(get_current_user),  # ✅ ADD THIS
+    if_match: Optional[str] = Header(default=None),
 ):
+    """
+    Update in one round trip: the ownership filter and the If-Match precondition
+    are part of the find-and-modify filter, and the post-image is returned.
+    Send the ETag of GET /trials/{id} as If-Match to get 412 instead of
+    silently overwriting a concurrent edit.
+    """
     db = get_db()
-    
+
     # ✅ VERIFY OWNERSHIP
-    existing = await db.trials.find_one({
-        "_id": oid(trial_id),
-        "userId": str(user["_id"])
-    })
-    if not existing:
+    q = {"_id": oid(trial_id), "userId": str(user["_id"])}
+    if if_match and if_match.strip() != "*":
+        q.update(if_match_filter(q["_id"], if_match))
+
+    try:
+        updated = await db.trials.find_one_and_update(
+            q,
+            {"$set": trial_updates(patch)},
+            return_document=ReturnDocument.AFTER,
+        )
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="Trial already exists for this date.")
+
+    if not updated:
+        # Slow path only: tell a failed precondition from a missing trial
+        if "$or" in q and await db.trials.count_documents(
+            {"_id": q["_id"], "userId": q["userId"]}, limit=1
+        ):
+            raise HTTPException(412, "Trial was modified since it was read")
         raise HTTPException(404, "Trial not found")
-    
-    updates = {k: v for k, v in patch.model_dump().items() if v is not None}
-    if "endDate" in updates:
-        updates["endDate"] = date_to_datetime_utc(updates["endDate"])
-    updates["updatedAt"] = datetime.now(timezone.utc)
-    
-    res = await db.trials.update_one(
-        {"_id": oid(trial_id)},
-        {"$set": updates}
-    )
-    
-    updated = await db.trials.find_one({"_id": oid(trial_id)})
-    return to_str_id(updated)
+
+    await sync_trial_reminders(db, updated, user)
+    await bump_trials_version(user["_id"])
+    events.publish(user["_id"], "updated", updated)
+    return FastJSONResponse(updated, headers={"ETag": trial_etag(updated)})
 
 @router.delete("/{trial_id}")
 async def delete_trial(
@@ -213,4 +763,7 @@ async def delete_trial(
     })
     if res.deleted_count == 0:
         raise HTTPException(404, "Trial not found")
+    await drop_trial_reminders(db, [trial_id])
+    await bump_trials_version(user["_id"])
+    events.publish(user["_id"], "deleted", {"_id": trial_id})
     return {"deleted": True}
\ No newline at end of file
@@ -5,7 +5,10 @@ from pydantic import BaseModel
 from bson import ObjectId
 import os
 
+from core.auth import bump_trials_version, load_user
 from core.database import get_db
+from core import events
+from services.reminders.scheduler import sync_trial_reminders
 
 router = APIRouter(prefix="/webhooks", tags=["webhooks"])
 
@@ -45,5 +48,11 @@ async def gumloop_create_trial(
     doc["updatedAt"] = now
 
     res = await db.trials.insert_one(doc)
+    # alertDays come from the user's preferences when userId is a user id
+    user = await load_user(payload.userId) if ObjectId.is_valid(payload.userId) else None
+    await sync_trial_reminders(db, doc, user)
+    if user is not None:
+        await bump_trials_version(user["_id"])
+    events.publish(payload.userId, "created", doc)
     doc["_id"] = str(res.inserted_id)
     return doc
\ No newline at end of file
@@ -1,4 +1,6 @@
 # services/email_monitor/detector.py
+import re
+from typing import Dict, Iterable, List, Tuple
 
 KEYWORDS_SUBJECT = [
     "trial", "free trial", "your trial", "essai", "essai gratuit",
@@ -12,24 +14,72 @@ KEYWORDS_BODY = [
     "fin de l'essai", "vous serez facturé", "renouvellement",
 ]
 
-def is_trial_candidate(subject: str, sender: str, snippet: str) -> bool:
-    s = (subject or "").lower()
-    f = (sender or "").lower()
-    b = (snippet or "").lower()
+SENDER_HINTS = ["no-reply", "noreply", "billing", "receipt"]
+
+
+def _keyword_pattern(keywords: Iterable[str]) -> "re.Pattern[str]":
+    """
+    Compile keywords into one regex shaped like a trie ("trial(?: ends)?|...").
+    At each position the engine follows a single branch, so the cost of a search
+    barely grows with the number of keywords, unlike `any(k in s ...)` or a flat
+    "k1|k2|..." alternation. A match means "some keyword is a substring".
+    """
+    trie: Dict[str, dict] = {}
+    for keyword in keywords:
+        node = trie
+        for ch in keyword:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def _build(node: Dict[str, dict]) -> str:
+        branches = [re.escape(ch) + _build(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+        if len(branches) == 1 and "" not in node:
+            return branches[0]
+        group = "(?:" + "|".join(branches) + ")"
+        # A keyword ends here: the longer ones are optional
+        return group + "?" if "" in node else group
+
+    return re.compile(_build(trie))
+
+
+# Built once at import time
+_SUBJECT_RE = _keyword_pattern(KEYWORDS_SUBJECT)
+_BODY_RE = _keyword_pattern(KEYWORDS_BODY)
+_SENDER_RE = _keyword_pattern(SENDER_HINTS)
+
+# Threshold V1
+CANDIDATE_MIN_SCORE = 2
 
+
+def trial_score(subject: str, sender: str, snippet: str) -> int:
     score = 0
 
     # Subject keywords
-    if any(k in s for k in KEYWORDS_SUBJECT):
+    if _SUBJECT_RE.search((subject or "").lower()):
         score += 2
 
     # Body/snippet keywords
-    if any(k in b for k in KEYWORDS_BODY):
+    if _BODY_RE.search((snippet or "").lower()):
         score += 1
 
     # Sender hints
-    if "no-reply" in f or "noreply" in f or "billing" in f or "receipt" in f:
+    if _SENDER_RE.search((sender or "").lower()):
         score += 1
 
-    # Threshold V1
-    return score >= 2
+    return score
+
+
+def is_trial_candidate(subject: str, sender: str, snippet: str) -> bool:
+    return trial_score(subject, sender, snippet) >= CANDIDATE_MIN_SCORE
+
+
+def trial_scores(messages: Iterable[Tuple[str, str, str]]) -> List[int]:
+    """Score many (subject, sender, snippet) tuples in one call."""
+    return [trial_score(subject, sender, snippet) for subject, sender, snippet in messages]
+
+
+def are_trial_candidates(messages: Iterable[Tuple[str, str, str]]) -> List[bool]:
+    """Batch version of is_trial_candidate, same results in the same order."""
+    return [score >= CANDIDATE_MIN_SCORE for score in trial_scores(messages)]
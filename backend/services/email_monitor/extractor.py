@@ -0,0 +1,269 @@
+# services/email_monitor/extractor.py
+"""
+Trial end date / renewal price extraction (EN + FR) from subject, snippet and body.
+
+Every pattern has a name. The first time a sender domain yields a hinted
+date or price (next to "ends", "charged", ...), the name of the pattern that
+found it is cached for that domain; the next emails from the same sender
+(Netflix, Spotify, ...) are tried against that pattern alone, and go through
+the full parser unless it finds a hinted match.
+
+Price parsing and sender domain examples run as doctests:
+    cd backend && python -m doctest services/email_monitor/extractor.py
+"""
+from __future__ import annotations
+import os
+import re
+from datetime import date, datetime, timedelta, timezone
+from email.utils import parseaddr
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from core.cache import TTLCache
+
+MONTHS = {
+    # EN
+    "january": 1, "jan": 1, "february": 2, "feb": 2, "march": 3, "mar": 3,
+    "april": 4, "apr": 4, "may": 5, "june": 6, "jun": 6, "july": 7, "jul": 7,
+    "august": 8, "aug": 8, "september": 9, "sept": 9, "sep": 9,
+    "october": 10, "oct": 10, "november": 11, "nov": 11, "december": 12, "dec": 12,
+    # FR
+    "janvier": 1, "janv": 1, "février": 2, "fevrier": 2, "févr": 2, "fevr": 2,
+    "mars": 3, "avril": 4, "avr": 4, "mai": 5, "juin": 6, "juillet": 7, "juil": 7,
+    "août": 8, "aout": 8, "septembre": 9, "octobre": 10, "novembre": 11,
+    "décembre": 12, "decembre": 12, "déc": 12,
+}
+_MONTH = "(?P<month>" + "|".join(sorted(MONTHS, key=len, reverse=True)) + r")\.?"
+
+# Words announcing the end of the trial / the first charge
+_END_HINT = re.compile(
+    r"(ends?|ending|expires?|expiring|renews?|renewal|charged|billed|until|"
+    r"prend fin|se termine|expire|fin de|renouvel|factur|prélev|jusqu)",
+    re.IGNORECASE,
+)
+_PRICE_HINT = re.compile(
+    r"(charged|billed|renew|then|per month|/mo|a month|factur|prélev|puis|par mois)",
+    re.IGNORECASE,
+)
+# How far before a date/price its hint may appear
+_HINT_WINDOW = 60
+
+_FR_HINT = re.compile(r"\b(essai|le|les|votre|jours|facturé|abonnement|mois)\b", re.IGNORECASE)
+
+_RELATIVE_UNITS = {
+    "day": 1, "days": 1, "jour": 1, "jours": 1,
+    "week": 7, "weeks": 7, "semaine": 7, "semaines": 7,
+    "month": 30, "months": 30, "mois": 30,
+}
+
+CURRENCY_SYMBOLS = {"$": "USD", "us$": "USD", "ca$": "CAD", "c$": "CAD", "a$": "AUD", "€": "EUR", "£": "GBP"}
+CURRENCY_CODES = ["USD", "CAD", "EUR", "GBP", "AUD", "CHF"]
+# "1,299.00", "1.299,00", "1 299,00" (thousands grouped), or up to 5 plain digits
+_AMOUNT = r"(?P<amount>\d{1,3}(?:[.,\u00a0\u202f ]\d{3})+(?:[.,]\d{1,2})?|\d{1,5}(?:[.,]\d{1,2})?)"
+_GROUP_SEPARATORS = re.compile(r"[.,\u00a0\u202f ]")
+_SYMBOL = r"(?P<currency>US\$|CA\$|C\$|A\$|\$|€|£)"
+_CODE = "(?P<currency>" + "|".join(CURRENCY_CODES) + ")"
+
+
+def _year_for(month: int, day: int, received: date) -> int:
+    # No year in the text: the first such date on or after the email
+    candidate = date(received.year, month, day)
+    return received.year if candidate >= received else received.year + 1
+
+
+def _from_month_name(m: re.Match, received: date, french: bool) -> Optional[date]:
+    month = MONTHS[m.group("month").lower()]
+    day = int(m.group("day"))
+    year = int(m.group("year")) if m.group("year") else _year_for(month, day, received)
+    return date(year, month, day)
+
+
+def _from_iso(m: re.Match, received: date, french: bool) -> Optional[date]:
+    return date(int(m.group("year")), int(m.group("month")), int(m.group("day")))
+
+
+def _from_numeric(m: re.Match, received: date, french: bool) -> Optional[date]:
+    a, b = int(m.group("a")), int(m.group("b"))
+    year = int(m.group("year"))
+    if year < 100:
+        year += 2000
+    # dd/mm in French or when the first number cannot be a month, mm/dd otherwise
+    if french or a > 12:
+        day, month = a, b
+    else:
+        month, day = a, b
+    return date(year, month, day)
+
+
+def _from_relative(m: re.Match, received: date, french: bool) -> Optional[date]:
+    return received + timedelta(days=int(m.group("n")) * _RELATIVE_UNITS[m.group("unit").lower()])
+
+
+DateParser = Callable[[re.Match, date, bool], Optional[date]]
+
+DATE_PATTERNS: List[Tuple[str, "re.Pattern[str]", DateParser]] = [
+    ("iso", re.compile(r"\b(?P<year>\d{4})-(?P<month>\d{1,2})-(?P<day>\d{1,2})\b"), _from_iso),
+    ("month_day", re.compile(
+        r"\b" + _MONTH + r"\s+(?P<day>\d{1,2})(?:st|nd|rd|th)?(?:,?\s+(?P<year>\d{4}))?\b",
+        re.IGNORECASE,
+    ), _from_month_name),
+    ("day_month", re.compile(
+        r"\b(?P<day>\d{1,2})(?:er|st|nd|rd|th)?\s+(?:of\s+)?" + _MONTH + r"(?:,?\s+(?P<year>\d{4}))?\b",
+        re.IGNORECASE,
+    ), _from_month_name),
+    ("numeric", re.compile(r"\b(?P<a>\d{1,2})[/.](?P<b>\d{1,2})[/.](?P<year>\d{4}|\d{2})\b"), _from_numeric),
+    ("relative", re.compile(
+        r"\b(?:in|within|dans|d'ici)\s+(?P<n>\d{1,3})\s+(?P<unit>days?|jours?|weeks?|semaines?|months?|mois)\b",
+        re.IGNORECASE,
+    ), _from_relative),
+    ("trial_length", re.compile(
+        r"\b(?P<n>\d{1,3})[- ](?P<unit>days?|jours?|weeks?|semaines?|months?|mois)\s+(?:free\s+)?(?:trial|d'essai)|"
+        r"\bessai(?:\s+gratuit)?\s+(?:de\s+)?(?P<n2>\d{1,3})\s+(?P<unit2>jours?|semaines?|mois)\b",
+        re.IGNORECASE,
+    ), lambda m, received, french: received + timedelta(
+        days=int(m.group("n") or m.group("n2")) * _RELATIVE_UNITS[(m.group("unit") or m.group("unit2")).lower()]
+    )),
+]
+
+PRICE_PATTERNS: List[Tuple[str, "re.Pattern[str]"]] = [
+    ("symbol_before", re.compile(_SYMBOL + r"\s?" + _AMOUNT)),
+    ("symbol_after", re.compile(_AMOUNT + r"\s?" + _SYMBOL)),
+    ("code_before", re.compile(r"\b" + _CODE + r"\s?" + _AMOUNT)),
+    ("code_after", re.compile(_AMOUNT + r"\s?" + _CODE + r"\b")),
+]
+_DATE_PATTERNS_BY_NAME = {name: (rx, parse) for name, rx, parse in DATE_PATTERNS}
+_PRICE_PATTERNS_BY_NAME = dict(PRICE_PATTERNS)
+
+# sender domain -> {"date": pattern name, "price": pattern name}
+TEMPLATE_CACHE_SIZE = int(os.environ.get("EXTRACTOR_TEMPLATE_CACHE_SIZE", "10000"))
+_templates = TTLCache(maxsize=TEMPLATE_CACHE_SIZE, ttl=24 * 3600)
+
+
+# Second-level labels that country TLDs sell domains under (co.uk, com.au,
+# co.jp, ne.jp, gouv.fr, ...): there the registrable domain has three labels
+_COUNTRY_SECOND_LEVELS = {"ac", "co", "com", "edu", "gob", "gov", "gouv", "ne", "net", "or", "org"}
+
+
+def sender_domain(sender: str) -> str:
+    """
+    >>> sender_domain("Netflix <info@mailer.netflix.com>"), sender_domain("billing@spotify.co.uk")
+    ('netflix.com', 'spotify.co.uk')
+    """
+    address = parseaddr(sender or "")[1].lower()
+    labels = address.rpartition("@")[2].split(".")
+    size = 3 if len(labels) >= 3 and len(labels[-1]) == 2 and labels[-2] in _COUNTRY_SECOND_LEVELS else 2
+    return ".".join(labels[-size:])
+
+
+def _hinted(text: str, start: int, hint: "re.Pattern[str]") -> bool:
+    return bool(hint.search(text, max(0, start - _HINT_WINDOW), start))
+
+
+def _find_date(text: str, received: date, french: bool, names: List[str]) -> Optional[Tuple[date, str, bool]]:
+    """
+    Earliest date on or after the email among those announced by an end/charge
+    hint, else the earliest date on or after the email.
+    Returns (date, pattern name, hinted).
+    """
+    best: Optional[Tuple[bool, date, str]] = None
+    for name in names:
+        rx, parse = _DATE_PATTERNS_BY_NAME[name]
+        for m in rx.finditer(text):
+            try:
+                found = parse(m, received, french)
+            except (ValueError, KeyError, OverflowError):
+                continue
+            if found is None or found < received or found > received + timedelta(days=400):
+                continue
+            # Relative phrasings ("in 3 days", "7-day trial") carry their own hint
+            hinted = name in ("relative", "trial_length") or _hinted(text, m.start(), _END_HINT)
+            key = (not hinted, found, name)
+            if best is None or key < best:
+                best = key
+    return (best[1], best[2], not best[0]) if best else None
+
+
+def _parse_amount(raw: str) -> float:
+    """
+    The last separator is the decimal mark when 1-2 digits follow it; every
+    other separator groups thousands.
+
+    >>> _parse_amount("1,299.00"), _parse_amount("1.299,00"), _parse_amount("9,99"), _parse_amount("1 299")
+    (1299.0, 1299.0, 9.99, 1299.0)
+    """
+    parts = _GROUP_SEPARATORS.split(raw)
+    if len(parts) > 1 and len(parts[-1]) <= 2:
+        return float("".join(parts[:-1]) + "." + parts[-1])
+    return float("".join(parts))
+
+
+def _find_price(text: str, names: List[str]) -> Optional[Tuple[float, str, str, bool]]:
+    """
+    The first price announced by a charge hint, else the first price.
+    Returns (amount, currency, pattern name, hinted).
+
+    >>> names = list(_PRICE_PATTERNS_BY_NAME)
+    >>> _find_price("then $1,299.00 a year", names)[:2], _find_price("puis 1,299.00 $ par an", names)[:2]
+    ((1299.0, 'USD'), (1299.0, 'USD'))
+    >>> _find_price("puis €1.299,00 par an", names)[:2]
+    (1299.0, 'EUR')
+    """
+    fallback = None
+    for name in names:
+        for m in _PRICE_PATTERNS_BY_NAME[name].finditer(text):
+            amount = _parse_amount(m.group("amount"))
+            currency = m.group("currency")
+            currency = CURRENCY_SYMBOLS.get(currency.lower(), currency.upper())
+            if _hinted(text, m.start(), _PRICE_HINT):
+                return amount, currency, name, True
+            if fallback is None:
+                fallback = (amount, currency, name, False)
+    return fallback
+
+
+def extract_trial_details(
+    subject: str,
+    sender: str,
+    snippet: str,
+    *,
+    received_at: datetime,
+    body: str = "",
+) -> Dict[str, Any]:
+    """
+    Returns {"endDate": date | None, "renewalPrice": float | None, "currency": str | None}.
+    `received_at` anchors relative dates ("in 3 days") and dates without a year.
+    """
+    text = " \n ".join(t for t in (subject, snippet, body) if t)
+    received = received_at.astimezone(timezone.utc).date()
+    french = len(_FR_HINT.findall(text)) >= 2
+    domain = sender_domain(sender)
+    template = _templates.get(domain) or {}
+
+    # The domain's pattern is a shortcut only when its match is hinted;
+    # otherwise the full parser decides, so the result never depends on
+    # what was parsed before
+    found_date = None
+    if template.get("date"):
+        found_date = _find_date(text, received, french, [template["date"]])
+    if found_date is None or not found_date[2]:
+        found_date = _find_date(text, received, french, list(_DATE_PATTERNS_BY_NAME))
+
+    found_price = None
+    if template.get("price"):
+        found_price = _find_price(text, [template["price"]])
+    if found_price is None or not found_price[3]:
+        found_price = _find_price(text, list(_PRICE_PATTERNS_BY_NAME))
+
+    # Only hinted matches teach the domain a pattern
+    learned_date = found_date[1] if found_date and found_date[2] else None
+    learned_price = found_price[2] if found_price and found_price[3] else None
+    if domain and (learned_date or learned_price):
+        _templates.set(domain, {
+            "date": learned_date or template.get("date"),
+            "price": learned_price or template.get("price"),
+        })
+
+    return {
+        "endDate": found_date[0] if found_date else None,
+        "renewalPrice": found_price[0] if found_price else None,
+        "currency": found_price[1] if found_price else None,
+    }
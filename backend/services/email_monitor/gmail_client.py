@@ -1,15 +1,297 @@
 # services/email_monitor/gmail_client.py
 from __future__ import annotations
+import asyncio
+import json
 import os
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlencode
+import httpx
+
+from core.cache import TTLCache
+from core.google_api import GoogleApiError, raise_for_google_error, refresh_access_token
+from core.rate_limit import TokenBucket, backoff_delay
+from core.http_client import get_http_client
+from core.metrics import GMAIL_REQUEST_SECONDS, GMAIL_REQUESTS, GMAIL_THROTTLED_SECONDS
 from core.security import encryption
 
 GMAIL_SCOPES = [
     "https://www.googleapis.com/auth/gmail.readonly",
 ]
 
-def build_gmail_service_from_user(user: dict):
+GMAIL_API_BASE = os.environ.get("GMAIL_API_BASE", "https://gmail.googleapis.com")
+_USER_PATH = "/gmail/v1/users/me"
+
+# Refresh a little before Google says the token expires
+_EXPIRY_SKEW_MS = 60_000
+
+# Authorized Gmail clients, reused across scans of the same user.
+# Keyed by (user id, token version) so a new consent never reuses old credentials.
+GMAIL_CLIENT_CACHE_SIZE = int(os.environ.get("GMAIL_CLIENT_CACHE_SIZE", "1000"))
+GMAIL_CLIENT_CACHE_TTL_SECONDS = float(os.environ.get("GMAIL_CLIENT_CACHE_TTL_SECONDS", "3600"))
+
+_clients = TTLCache(maxsize=GMAIL_CLIENT_CACHE_SIZE, ttl=GMAIL_CLIENT_CACHE_TTL_SECONDS)
+
+# Gmail quota units per call (https://developers.google.com/gmail/api/reference/quota).
+# A batch costs the sum of its sub-requests.
+QUOTA_UNITS = {
+    "messages.list": 5,
+    "messages.get": 5,
+    "history.list": 2,
+    "getProfile": 1,
+    "watch": 100,
+}
+
+# Gmail allows 250 units/s per user and 1,200,000 units/min per project.
+# The project budget is per process: divide it between scanning processes.
+GMAIL_USER_UNITS_PER_SECOND = float(os.environ.get("GMAIL_USER_UNITS_PER_SECOND", "250"))
+GMAIL_PROJECT_UNITS_PER_SECOND = float(os.environ.get("GMAIL_PROJECT_UNITS_PER_SECOND", "20000"))
+
+# Rate limited (429, 403 *RateLimitExceeded) or transient (5xx) answers are
+# retried this many times with jittered exponential backoff
+GMAIL_MAX_RETRIES = int(os.environ.get("GMAIL_MAX_RETRIES", "5"))
+GMAIL_RETRY_BASE_SECONDS = float(os.environ.get("GMAIL_RETRY_BASE_SECONDS", "1"))
+GMAIL_RETRY_MAX_SECONDS = float(os.environ.get("GMAIL_RETRY_MAX_SECONDS", "32"))
+
+_RATE_LIMIT_REASONS = {"rateLimitExceeded", "userRateLimitExceeded"}
+
+_project_bucket = TokenBucket(GMAIL_PROJECT_UNITS_PER_SECOND)
+
+
+def _retryable(e: GoogleApiError) -> bool:
+    if e.status == 429 or e.status >= 500:
+        return True
+    return e.status == 403 and e.reason in _RATE_LIMIT_REASONS
+
+
+class GmailClient:
+    """
+    Async Gmail API client for one user, on the shared pooled HTTP client.
+    Refreshes its own access token when it expires or Gmail answers 401.
+    Every call first takes its quota units from the user's and the project's
+    token buckets, and rate-limit / 5xx answers are retried with backoff;
+    `usage` counts requests, units, retries and the time calls spent throttled
+    (summed over concurrent calls).
+    """
+
+    def __init__(
+        self,
+        access_token: Optional[str],
+        refresh_token: str,
+        expiry_ms: Optional[int] = None,
+        *,
+        http: Optional[httpx.AsyncClient] = None,
+    ):
+        self.access_token = access_token
+        self.refresh_token = refresh_token
+        self.expiry_ms = expiry_ms
+        self._http = http
+        self._refresh_lock = asyncio.Lock()
+        # Last access token written to googleTokens, see token_updates()
+        self._stored_access_token = access_token
+        self._bucket = TokenBucket(GMAIL_USER_UNITS_PER_SECOND)
+        self.usage: Dict[str, float] = {"requests": 0, "units": 0, "retries": 0, "throttledMs": 0.0}
+
+    @property
+    def http(self) -> httpx.AsyncClient:
+        return self._http or get_http_client()
+
+    def _token_expired(self) -> bool:
+        if not self.access_token:
+            return True
+        return bool(self.expiry_ms) and self.expiry_ms - _EXPIRY_SKEW_MS <= time.time() * 1000
+
+    async def _refresh(self, stale_token: Optional[str]) -> None:
+        async with self._refresh_lock:
+            # Another coroutine refreshed while we waited for the lock
+            if self.access_token != stale_token:
+                return
+            tokens = await refresh_access_token(
+                self.refresh_token,
+                client_id=os.environ["GOOGLE_CLIENT_ID"],
+                client_secret=os.environ["GOOGLE_CLIENT_SECRET"],
+            )
+            self.access_token = tokens["accessToken"]
+            self.expiry_ms = tokens["expiryDate"]
+
+    async def _throttle(self, units: int) -> None:
+        waited = await self._bucket.acquire(units)
+        waited += await _project_bucket.acquire(units)
+        self.usage["throttledMs"] += waited * 1000
+        if waited:
+            GMAIL_THROTTLED_SECONDS.inc(waited)
+
+    async def _send(self, method: str, url: str, *, units: int, call: str, **kwargs) -> httpx.Response:
+        """`call` names the API method (messages.list, batch, ...) in the metrics."""
+        extra_headers = kwargs.pop("headers", {})
+        attempt = 0
+        while True:
+            await self._throttle(units)
+            self.usage["requests"] += 1
+            self.usage["units"] += units
+            started = time.perf_counter()
+            code = "error"  # no HTTP answer (timeout, connection)
+            try:
+                resp = await self._send_once(method, url, extra_headers, **kwargs)
+                code = str(resp.status_code)
+                return resp
+            except GoogleApiError as e:
+                code = str(e.status)
+                if attempt >= GMAIL_MAX_RETRIES or not _retryable(e):
+                    raise
+                delay = backoff_delay(
+                    attempt,
+                    base=GMAIL_RETRY_BASE_SECONDS,
+                    cap=GMAIL_RETRY_MAX_SECONDS,
+                    retry_after=e.retry_after,
+                )
+                # Concurrent calls for this user wait too instead of piling on
+                self._bucket.pause(delay)
+                self.usage["retries"] += 1
+                attempt += 1
+            finally:
+                GMAIL_REQUEST_SECONDS.labels(call).observe(time.perf_counter() - started)
+                GMAIL_REQUESTS.labels(call, code).inc()
+
+    async def _send_once(self, method: str, url: str, extra_headers: Dict[str, str], **kwargs) -> httpx.Response:
+        if self._token_expired():
+            await self._refresh(self.access_token)
+        for attempt in range(2):
+            token = self.access_token
+            resp = await self.http.request(
+                method, url, headers={**extra_headers, "Authorization": f"Bearer {token}"}, **kwargs
+            )
+            if resp.status_code == 401 and attempt == 0:
+                await self._refresh(token)
+                continue
+            raise_for_google_error(resp)
+            return resp
+
+    async def _get(self, path: str, params: Dict[str, Any], *, method: str) -> Dict[str, Any]:
+        params = {k: v for k, v in params.items() if v is not None}
+        resp = await self._send(
+            "GET", f"{GMAIL_API_BASE}{_USER_PATH}{path}", params=params, units=QUOTA_UNITS[method], call=method
+        )
+        return resp.json()
+
+    async def list_messages(self, q: str, *, max_results: int, page_token: Optional[str] = None) -> Dict[str, Any]:
+        return await self._get(
+            "/messages", {"q": q, "maxResults": max_results, "pageToken": page_token}, method="messages.list"
+        )
+
+    async def get_message_metadata(self, message_id: str, headers: List[str]) -> Dict[str, Any]:
+        return await self._get(
+            f"/messages/{message_id}", {"format": "metadata", "metadataHeaders": headers}, method="messages.get"
+        )
+
+    async def list_history(self, start_history_id: str, *, page_token: Optional[str] = None) -> Dict[str, Any]:
+        return await self._get("/history", {
+            "startHistoryId": start_history_id,
+            "historyTypes": "messageAdded",
+            "pageToken": page_token,
+        }, method="history.list")
+
+    async def get_profile(self) -> Dict[str, Any]:
+        return await self._get("/profile", {}, method="getProfile")
+
+    async def watch(self, topic_name: str, label_ids: Optional[List[str]] = None) -> Dict[str, Any]:
+        """
+        Ask Gmail to publish mailbox changes to a Pub/Sub topic (users.watch).
+        Returns {"historyId", "expiration"} (ms); the watch must be renewed before then.
+        """
+        body: Dict[str, Any] = {"topicName": topic_name}
+        if label_ids:
+            body.update(labelIds=label_ids, labelFilterBehavior="include")
+        resp = await self._send(
+            "POST", f"{GMAIL_API_BASE}{_USER_PATH}/watch", json=body, units=QUOTA_UNITS["watch"], call="watch"
+        )
+        return resp.json()
+
+    async def batch_get_metadata(
+        self, message_ids: List[str], headers: List[str]
+    ) -> Tuple[Dict[str, Dict[str, Any]], List[str]]:
+        """
+        Fetch metadata for up to 100 messages in one multipart/mixed request
+        to the Gmail batch endpoint.
+        Returns ({message_id: metadata}, [ids whose sub-request failed]).
+        """
+        boundary = f"batch_{uuid.uuid4().hex}"
+        query = urlencode({"format": "metadata", "metadataHeaders": headers}, doseq=True)
+        parts = []
+        for mid in message_ids:
+            parts.append(
+                f"--{boundary}\r\n"
+                "Content-Type: application/http\r\n"
+                f"Content-ID: <{mid}>\r\n\r\n"
+                f"GET {_USER_PATH}/messages/{mid}?{query}\r\n\r\n"
+            )
+        parts.append(f"--{boundary}--\r\n")
+
+        resp = await self._send(
+            "POST",
+            f"{GMAIL_API_BASE}/batch/gmail/v1",
+            content="".join(parts).encode(),
+            headers={"Content-Type": f"multipart/mixed; boundary={boundary}"},
+            units=QUOTA_UNITS["messages.get"] * len(message_ids),
+            call="batch",
+        )
+
+        results: Dict[str, Dict[str, Any]] = {}
+        for content_id, status, body in _parse_batch_response(resp):
+            if status == 200 and content_id in message_ids:
+                results[content_id] = json.loads(body)
+        failed = [mid for mid in message_ids if mid not in results]
+        return results, failed
+
+    def token_updates(self) -> Dict[str, Any]:
+        """
+        If the access token was refreshed since it was last stored, return the
+        `$set` fields that store it (encrypted) with its expiry on the user
+        document, so the next scan does not pay for the refresh again.
+        Returns {} when the stored token is still current.
+        """
+        if not self.access_token or self.access_token == self._stored_access_token:
+            return {}
+        self._stored_access_token = self.access_token
+        return {
+            "googleTokens.accessToken": encryption.encrypt(self.access_token),
+            "googleTokens.expiryDate": self.expiry_ms,
+        }
+
+
+def _parse_batch_response(resp: httpx.Response):
+    """Yield (content_id, http_status, body) for each part of a batch response."""
+    content_type = resp.headers.get("Content-Type", "")
+    boundary = content_type.split("boundary=", 1)[-1].strip('"')
+    for part in resp.text.split(f"--{boundary}"):
+        part = part.strip()
+        if not part or part == "--":
+            continue
+        # Part headers, then the embedded HTTP response (status line, headers, body)
+        part_headers, _, http_response = part.partition("\r\n\r\n")
+        content_id = ""
+        for line in part_headers.splitlines():
+            name, _, value = line.partition(":")
+            if name.strip().lower() == "content-id":
+                content_id = value.strip().strip("<>")
+                if content_id.startswith("response-"):
+                    content_id = content_id[len("response-"):]
+        head, _, body = http_response.partition("\r\n\r\n")
+        status_line = head.splitlines()[0] if head else ""
+        try:
+            status = int(status_line.split()[1])
+        except (IndexError, ValueError):
+            continue
+        yield content_id, status, body
+
+
+def _token_version(tokens: dict) -> str:
+    # The refresh token is re-encrypted with a fresh nonce on every OAuth consent
+    return tokens["refreshToken"]["nonce"]
+
+
+def gmail_client_for_user(user: dict) -> GmailClient:
     tokens = user.get("googleTokens") or {}
     enc_access = tokens.get("accessToken")
     enc_refresh = tokens.get("refreshToken")
@@ -17,16 +299,16 @@ def build_gmail_service_from_user(user: dict):
     if not enc_refresh:
         raise ValueError("Missing refresh token for user")
 
-    access_token = encryption.decrypt(enc_access) if enc_access else None
-    refresh_token = encryption.decrypt(enc_refresh)
+    key = (str(user["_id"]), _token_version(tokens))
+    client = _clients.get(key)
+    if client is not None:
+        return client
 
-    creds = Credentials(
-        token=access_token,
-        refresh_token=refresh_token,
-        token_uri="https://oauth2.googleapis.com/token",
-        client_id=os.environ["GOOGLE_CLIENT_ID"],
-        client_secret=os.environ["GOOGLE_CLIENT_SECRET"],
-        scopes=GMAIL_SCOPES,
+    client = GmailClient(
+        access_token=encryption.decrypt(enc_access) if enc_access else None,
+        refresh_token=encryption.decrypt(enc_refresh),
+        expiry_ms=tokens.get("expiryDate"),
     )
+    _clients.set(key, client)
+    return client
 
-    return build("gmail", "v1", credentials=creds)
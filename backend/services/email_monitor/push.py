@@ -0,0 +1,45 @@
+# services/email_monitor/push.py
+from __future__ import annotations
+import base64
+import json
+import time
+from typing import Any, Dict, Tuple
+
+from core.config import GMAIL_PUBSUB_TOPIC, GMAIL_WATCH_RENEW_SECONDS
+from core.google_api import GoogleApiError
+from services.email_monitor.gmail_client import GmailClient
+
+# Gmail push: users.watch publishes "mailbox changed" notifications to a
+# Pub/Sub topic, whose push subscription POSTs them to /webhooks/gmail/push
+# (routes/gmail_push.py). Scans register and renew the watch; a notification
+# only queues an incremental scan of that user, which the scan queue workers
+# (jobs/cron_runner.py --worker) run.
+
+WATCH_LABELS = ["INBOX"]
+
+
+async def watch_updates(gmail: GmailClient, user: dict) -> Dict[str, Any]:
+    """
+    (Re-)register the user's watch when push is configured and the current one
+    expires within GMAIL_WATCH_RENEW_SECONDS. Returns the `$set` fields to store,
+    {} when nothing was done. A failed watch never fails the scan.
+    """
+    if not GMAIL_PUBSUB_TOPIC:
+        return {}
+    expiration = (user.get("gmail") or {}).get("watchExpiration") or 0
+    if expiration - time.time() * 1000 > GMAIL_WATCH_RENEW_SECONDS * 1000:
+        return {}
+    try:
+        resp = await gmail.watch(GMAIL_PUBSUB_TOPIC, WATCH_LABELS)
+    except GoogleApiError as e:
+        print(f"⚠️  Gmail watch failed for user {user['_id']}: {e}")
+        return {}
+    return {"gmail.watchExpiration": int(resp["expiration"])}
+
+def decode_push(body: Dict[str, Any]) -> Tuple[str, int]:
+    """(emailAddress, historyId) of a Pub/Sub push body; ValueError if malformed."""
+    try:
+        data = json.loads(base64.b64decode(body["message"]["data"]))
+        return data["emailAddress"], int(data["historyId"])
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"Invalid Gmail push payload: {e}")
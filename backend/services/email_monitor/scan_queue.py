@@ -0,0 +1,325 @@
+# services/email_monitor/scan_queue.py
+from __future__ import annotations
+import asyncio
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from core.bulk_writer import BulkWriter
+from core.config import (
+    SCAN_BULK_MAX_DELAY_SECONDS,
+    SCAN_BULK_MAX_OPS,
+    SCAN_TASK_LEASE_SECONDS,
+    SCAN_TASK_MAX_ATTEMPTS,
+    SCAN_TASK_RETRY_SECONDS,
+)
+from core.database import get_db
+from services.email_monitor.scanner import (
+    SCANNABLE_USERS,
+    scan_user_with_stats,
+    scan_writers,
+    scannable_users,
+)
+
+# Mongo-backed queue of Gmail scans.
+#
+# scan_jobs:  one document per "scan every user" request. `active: true` while
+#             it has unfinished tasks; a unique partial index on `active` makes
+#             overlapping cron triggers share the running job.
+# scan_tasks: one document per user scan. While `active`, `availableAt` is when
+#             it may be claimed: now or a retry time for queued tasks, the lease
+#             expiry for running ones, so a crashed worker's task comes back on
+#             its own. A unique partial index on (userId, active) keeps a single
+#             pending scan per user.
+#
+# Tasks are only run by `python -m jobs.cron_runner --worker` processes (the
+# Procfile's `worker`); POST /jobs/scan-gmail and the one-shot cron_runner
+# just queue them, the latter draining the queue itself before exiting.
+
+ENQUEUE_BATCH_SIZE = 1000
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+def _task_doc(user_id, job_id: Optional[ObjectId], options: Dict[str, Any], now: datetime) -> dict:
+    return {
+        "jobId": job_id,
+        "userId": user_id,
+        "status": "queued",
+        "active": True,
+        "attempts": 0,
+        "availableAt": now,
+        "options": options,
+        "createdAt": now,
+    }
+
+async def _insert_tasks(db, tasks: List[dict]) -> int:
+    """Insert tasks, skipping users that already have a pending scan. Returns the number inserted."""
+    try:
+        res = await db.scan_tasks.insert_many(tasks, ordered=False)
+        return len(res.inserted_ids)
+    except BulkWriteError as e:
+        if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+            raise
+        return e.details.get("nInserted", 0)
+
+async def enqueue_scan_job(
+    *,
+    max_results: int,
+    incremental: bool = True,
+    user_timeout: Optional[float] = None,
+    due_only: bool = True,
+) -> Tuple[dict, bool]:
+    """
+    Queue a scan of every Google user whose next scan is due (every one
+    without `due_only`), skipping users that already have a pending scan.
+    Returns (job, created); when a job is already active, that job is
+    returned with created=False and nothing is queued.
+    """
+    db = get_db()
+    now = _now()
+    options = {"maxResults": max_results, "incremental": incremental, "userTimeout": user_timeout}
+    job = {"_id": ObjectId(), "active": True, "options": options, "total": 0, "createdAt": now}
+    try:
+        await db.scan_jobs.insert_one(job)
+    except DuplicateKeyError:
+        existing = await db.scan_jobs.find_one({"active": True})
+        if existing is not None:
+            return existing, False
+        # The active job finished in between
+        return await enqueue_scan_job(
+            max_results=max_results, incremental=incremental, user_timeout=user_timeout, due_only=due_only
+        )
+
+    total = 0
+    batch: List[dict] = []
+    async for user in db.users.find(scannable_users(due_only), {"_id": 1}):
+        batch.append(_task_doc(user["_id"], job["_id"], options, now))
+        if len(batch) >= ENQUEUE_BATCH_SIZE:
+            total += await _insert_tasks(db, batch)
+            batch = []
+    if batch:
+        total += await _insert_tasks(db, batch)
+
+    job["total"] = total
+    await db.scan_jobs.update_one({"_id": job["_id"]}, {"$set": {"total": total}})
+    if total == 0:
+        await finish_scan_jobs()
+    return job, True
+
+async def enqueue_user_scan(
+    user_id,
+    *,
+    max_results: int,
+    incremental: bool = True,
+    user_timeout: Optional[float] = None,
+) -> bool:
+    """Queue one user's scan, outside any job. False if one is already pending."""
+    options = {"maxResults": max_results, "incremental": incremental, "userTimeout": user_timeout}
+    return await _insert_tasks(get_db(), [_task_doc(user_id, None, options, _now())]) == 1
+
+async def claim_scan_task(lease_seconds: float = SCAN_TASK_LEASE_SECONDS) -> Optional[dict]:
+    """Atomically lease the oldest available task, or None when nothing is due."""
+    now = _now()
+    return await get_db().scan_tasks.find_one_and_update(
+        {"active": True, "availableAt": {"$lte": now}},
+        {
+            "$set": {
+                "status": "running",
+                "availableAt": now + timedelta(seconds=lease_seconds),
+                "leaseId": uuid.uuid4().hex,
+                "startedAt": now,
+            },
+            "$inc": {"attempts": 1},
+        },
+        sort=[("availableAt", 1)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+def _task_result(task: dict, update: Dict[str, Any]) -> UpdateOne:
+    # leaseId: a task re-claimed after its lease expired belongs to the new worker
+    finished = update.get("status") in ("done", "failed")
+    doc: Dict[str, Any] = {"$set": update}
+    if finished:
+        doc["$unset"] = {"active": ""}
+    return UpdateOne({"_id": task["_id"], "leaseId": task["leaseId"]}, doc)
+
+def _task_stats(stats: Dict[str, Any]) -> Dict[str, Any]:
+    keys = ("created", "duplicates", "messages", "retries", "throttledMs", "mode", "durationMs")
+    return {k: stats.get(k) for k in keys}
+
+def _failure(task: dict, stats: Dict[str, Any]) -> UpdateOne:
+    now = _now()
+    update = {"error": stats["error"], "stats": _task_stats(stats)}
+    if task["attempts"] >= SCAN_TASK_MAX_ATTEMPTS:
+        return _task_result(task, {**update, "status": "failed", "finishedAt": now})
+    delay = SCAN_TASK_RETRY_SECONDS * 2 ** (task["attempts"] - 1)
+    return _task_result(task, {
+        **update,
+        "status": "queued",
+        "availableAt": now + timedelta(seconds=delay),
+    })
+
+async def _run_task(
+    db,
+    task: dict,
+    writers: Tuple[BulkWriter, BulkWriter, BulkWriter],
+    task_writer: BulkWriter,
+) -> Dict[str, Any]:
+    trial_writer, reminder_writer, user_writer = writers
+    if task["attempts"] > SCAN_TASK_MAX_ATTEMPTS:
+        # Leases kept expiring: the worker running it keeps dying
+        await task_writer.add(_task_result(task, {
+            "status": "failed", "error": "lease_expired", "finishedAt": _now(),
+        }))
+        return {"error": "lease_expired"}
+
+    user = await db.users.find_one({"_id": task["userId"], **SCANNABLE_USERS})
+    if user is None:
+        await task_writer.add(_task_result(task, {
+            "status": "failed", "error": "user_not_found", "finishedAt": _now(),
+        }))
+        return {"error": "user_not_found"}
+
+    options = task["options"]
+
+    def _saved(stats: Dict[str, Any]):
+        # Trials and the user's scan state are written: the counts are final
+        task_writer.add_nowait(_task_result(task, {
+            "status": "done",
+            "error": None,
+            "finishedAt": _now(),
+            "stats": _task_stats(stats),
+        }))
+
+    stats = await scan_user_with_stats(
+        user,
+        max_results=options["maxResults"],
+        incremental=options["incremental"],
+        timeout=options.get("userTimeout"),
+        trial_writer=trial_writer,
+        user_writer=user_writer,
+        reminder_writer=reminder_writer,
+        on_saved=_saved,
+    )
+    if stats["error"]:
+        await task_writer.add(_failure(task, stats))
+    return stats
+
+async def finish_scan_jobs() -> None:
+    """Close active jobs that have no unfinished task left."""
+    db = get_db()
+    async for job in db.scan_jobs.find({"active": True}, {"_id": 1}):
+        if await db.scan_tasks.find_one({"jobId": job["_id"], "active": True}, {"_id": 1}) is None:
+            await db.scan_jobs.update_one(
+                {"_id": job["_id"]},
+                {"$set": {"finishedAt": _now()}, "$unset": {"active": ""}},
+            )
+
+async def run_scan_workers(
+    concurrency: int = 1,
+    *,
+    forever: bool = False,
+    poll_seconds: float = 5.0,
+) -> Dict[str, Any]:
+    """
+    Drain the scan queue with `concurrency` workers in this process; any number
+    of processes can run this side by side. Returns when nothing is due, or
+    never with `forever` (then polling every `poll_seconds`).
+    Task results go through a bulk writer flushed after the scan writers, so
+    a task is marked done only once its trials and scan state are written.
+    """
+    db = get_db()
+    concurrency = max(1, concurrency)
+    totals: Dict[str, Any] = {"tasks": 0, "failed": 0, "retries": 0, "throttledMs": 0.0, "failures": {}}
+
+    writers = scan_writers(db)
+    task_writer = BulkWriter(
+        db.scan_tasks,
+        max_ops=SCAN_BULK_MAX_OPS,
+        max_delay=SCAN_BULK_MAX_DELAY_SECONDS,
+        flush_first=[writers[2]],
+    )
+
+    async def _worker():
+        while True:
+            task = await claim_scan_task()
+            if task is None:
+                if not forever:
+                    return
+                await task_writer.flush()
+                await finish_scan_jobs()
+                await asyncio.sleep(poll_seconds)
+                continue
+            stats = await _run_task(db, task, writers, task_writer)
+            totals["tasks"] += 1
+            totals["retries"] += stats.get("retries", 0)
+            totals["throttledMs"] += stats.get("throttledMs", 0.0)
+            if stats["error"]:
+                totals["failed"] += 1
+                totals["failures"][stats["error"]] = totals["failures"].get(stats["error"], 0) + 1
+
+    trial_writer, reminder_writer, user_writer = writers
+    # Exits in reverse: task_writer's final flush writes everything before it
+    async with trial_writer, reminder_writer, user_writer, task_writer:
+        await asyncio.gather(*(_worker() for _ in range(concurrency)))
+
+    await finish_scan_jobs()
+    totals["writes"] = {
+        "trials": trial_writer.stats,
+        "reminders": reminder_writer.stats,
+        "users": user_writer.stats,
+        "tasks": task_writer.stats,
+    }
+    return totals
+
+async def scan_job_status(job_id: ObjectId) -> Optional[dict]:
+    """Progress of a job from its tasks, or None if there is no such job."""
+    db = get_db()
+    job = await db.scan_jobs.find_one({"_id": job_id})
+    if job is None:
+        return None
+
+    tasks = {"queued": 0, "running": 0, "done": 0, "failed": 0}
+    totals = {"created": 0, "duplicates": 0, "messages": 0, "retries": 0, "throttledMs": 0.0}
+    failures: Dict[str, int] = {}
+    pipeline = [
+        {"$match": {"jobId": job_id}},
+        {"$group": {
+            "_id": {"status": "$status", "error": {"$cond": [{"$eq": ["$status", "failed"]}, "$error", None]}},
+            "count": {"$sum": 1},
+            "created": {"$sum": "$stats.created"},
+            "duplicates": {"$sum": "$stats.duplicates"},
+            "messages": {"$sum": "$stats.messages"},
+            "retries": {"$sum": "$stats.retries"},
+            "throttledMs": {"$sum": "$stats.throttledMs"},
+        }},
+    ]
+    async for row in db.scan_tasks.aggregate(pipeline):
+        status = row["_id"]["status"]
+        tasks[status] = tasks.get(status, 0) + row["count"]
+        for k in totals:
+            totals[k] += row[k]
+        if status == "failed":
+            error = row["_id"]["error"] or "unknown"
+            failures[error] = failures.get(error, 0) + row["count"]
+
+    if job.get("active"):
+        status = "running" if tasks["running"] or tasks["done"] or tasks["failed"] else "queued"
+    else:
+        status = "done"
+    return {
+        "jobId": str(job["_id"]),
+        "status": status,
+        "options": job["options"],
+        "total": job.get("total", 0),
+        "createdAt": job["createdAt"],
+        "finishedAt": job.get("finishedAt"),
+        "tasks": tasks,
+        **totals,
+        "failures": failures,
+    }
@@ -0,0 +1,74 @@
+# services/email_monitor/scan_schedule.py
+from __future__ import annotations
+import random
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional
+
+from core.config import (
+    GMAIL_WATCH_RENEW_SECONDS,
+    SCAN_INTERVAL_MAX_SECONDS,
+    SCAN_INTERVAL_MIN_SECONDS,
+    SCAN_INTERVAL_SOON_SECONDS,
+    SCAN_TRIAL_SOON_DAYS,
+)
+
+# Per-user scan schedule, kept on the user document:
+#   gmail.nextScanAt            when the user is next due (missing: due now)
+#   gmail.scanIntervalSeconds   current interval
+# A scan that queues new trial candidates resets the interval to the minimum;
+# a quiet one doubles it up to the maximum. While one of the user's trials ends
+# within SCAN_TRIAL_SOON_DAYS, the interval is capped at SCAN_INTERVAL_SOON_SECONDS
+# (renewal / cancellation mail is likely). With Gmail push, the next scan also
+# comes before the user's watch is due for renewal, since scans renew it.
+
+# ±10% so users who signed up together drift apart
+_JITTER = 0.1
+
+
+def due_filter(now: datetime) -> Dict[str, Any]:
+    """Users whose next scan is due; served by the gmail.nextScanAt index."""
+    return {"$or": [
+        {"gmail.nextScanAt": {"$lte": now}},
+        {"gmail.nextScanAt": None},
+    ]}
+
+def next_scan_interval(previous: Optional[float], new_candidates: int, trial_ending_soon: bool) -> float:
+    if new_candidates or previous is None:
+        interval = SCAN_INTERVAL_MIN_SECONDS
+    else:
+        interval = min(SCAN_INTERVAL_MAX_SECONDS, previous * 2)
+    if trial_ending_soon:
+        interval = min(interval, SCAN_INTERVAL_SOON_SECONDS)
+    return interval
+
+async def trial_ending_soon(db, user_id: str, now: datetime) -> bool:
+    doc = await db.trials.find_one({
+        "userId": user_id,
+        "endDate": {"$gte": now, "$lte": now + timedelta(days=SCAN_TRIAL_SOON_DAYS)},
+        "status": {"$nin": ["canceled", "expired"]},
+    }, {"_id": 1})
+    return doc is not None
+
+async def schedule_updates(
+    db,
+    user: dict,
+    new_candidates: int,
+    watch_expiration_ms: Optional[int] = None,
+) -> Dict[str, Any]:
+    """`$set` fields scheduling the user's next scan after one that just finished."""
+    now = datetime.now(timezone.utc)
+    previous = (user.get("gmail") or {}).get("scanIntervalSeconds")
+    soon = await trial_ending_soon(db, str(user["_id"]), now)
+    interval = next_scan_interval(previous, new_candidates, soon)
+    next_scan_at = now + timedelta(seconds=interval * random.uniform(1 - _JITTER, 1 + _JITTER))
+    if watch_expiration_ms:
+        renew_at = datetime.fromtimestamp(watch_expiration_ms / 1000, tz=timezone.utc) - timedelta(
+            seconds=GMAIL_WATCH_RENEW_SECONDS
+        )
+        # An expired watch (failed renewal) must not make the user due forever
+        if renew_at > now:
+            next_scan_at = min(next_scan_at, renew_at)
+    return {
+        "gmail.scanIntervalSeconds": interval,
+        "gmail.nextScanAt": next_scan_at,
+    }
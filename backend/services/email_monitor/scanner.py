@@ -1,14 +1,26 @@
 # services/email_monitor/scanner.py
 from __future__ import annotations
 import asyncio
+import time
 from datetime import datetime, timezone, date
-from typing import Dict, Any, List, Optional
-from googleapiclient.errors import HttpError
+from typing import AsyncIterator, Callable, Dict, Any, List, Optional, Tuple
+from bson import ObjectId
+from pymongo import UpdateOne
 
+from core.auth import invalidate_user
+from core.bulk_writer import BulkWriter
+from core import events
+from core.config import SCAN_BULK_MAX_OPS, SCAN_BULK_MAX_DELAY_SECONDS
 from core.database import get_db
-from services.email_monitor.gmail_client import build_gmail_service_from_user
-from services.email_monitor.detector import is_trial_candidate
+from core.google_api import GoogleApiError
+from core.metrics import SCAN_STAGE_SECONDS
+from services.email_monitor.gmail_client import GmailClient, gmail_client_for_user
+from services.email_monitor.detector import are_trial_candidates
+from services.email_monitor.extractor import extract_trial_details
 from services.email_monitor.queries import TRIAL_QUERY_V1
+from services.email_monitor.push import watch_updates
+from services.email_monitor.scan_schedule import due_filter, schedule_updates
+from services.reminders.scheduler import reminder_ops
 
 
 def _headers(payload: Dict[str, Any]) -> Dict[str, str]:
@@ -18,21 +30,124 @@ def _headers(payload: Dict[str, Any]) -> Dict[str, str]:
             out[h["name"]] = h["value"]
     return out
 
-async def _list_messages(gmail, q: str, max_results: int) -> List[Dict[str, str]]:
-    def _call():
-        return gmail.users().messages().list(userId="me", q=q, maxResults=max_results).execute()
-    resp = await asyncio.to_thread(_call)
-    return resp.get("messages", [])
-
-async def _get_message_metadata(gmail, message_id: str) -> Dict[str, Any]:
-    def _call():
-        return gmail.users().messages().get(
-            userId="me",
-            id=message_id,
-            format="metadata",
-            metadataHeaders=["From", "Subject", "Date"]
-        ).execute()
-    return await asyncio.to_thread(_call)
+# Messages requested per messages.list page; also the size of one metadata batch
+LIST_PAGE_SIZE = 50
+
+def _query_since(q: str, last_seen_ms: int) -> str:
+    """Narrow a Gmail query to mail received after `last_seen_ms` (Gmail `after:` takes seconds)."""
+    if last_seen_ms <= 0:
+        return q
+    return f"{q} after:{last_seen_ms // 1000}"
+
+async def _iter_message_id_pages(
+    gmail: GmailClient,
+    q: str,
+    *,
+    max_results: int,
+    page_size: int = LIST_PAGE_SIZE,
+) -> AsyncIterator[List[str]]:
+    """
+    Page through messages.list lazily, following nextPageToken, and yield
+    one list of message ids per page (newest first), up to `max_results` ids.
+    The caller stops iterating as soon as it has seen enough.
+    """
+    page_token = None
+    remaining = max_results
+    while remaining > 0:
+        resp = await gmail.list_messages(q, max_results=min(page_size, remaining), page_token=page_token)
+        ids = [m["id"] for m in resp.get("messages", [])]
+        if ids:
+            remaining -= len(ids)
+            yield ids
+        page_token = resp.get("nextPageToken")
+        if not page_token:
+            return
+
+async def _iter_chunks(ids: List[str], size: int = LIST_PAGE_SIZE) -> AsyncIterator[List[str]]:
+    for i in range(0, len(ids), size):
+        yield ids[i:i + size]
+
+METADATA_HEADERS = ["From", "Subject", "Date"]
+
+# Gmail accepts up to 100 calls per batch but recommends staying at 50 or below
+METADATA_BATCH_SIZE = LIST_PAGE_SIZE
+
+async def _get_messages_metadata(gmail: GmailClient, message_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Fetch metadata for many messages through the Gmail batch endpoint,
+    one HTTP round trip per METADATA_BATCH_SIZE messages.
+    Sub-requests that fail inside a batch are retried one by one;
+    messages deleted in the meantime (404) are skipped.
+    Returns {message_id: metadata}.
+    """
+    out: Dict[str, Dict[str, Any]] = {}
+    failed: List[str] = []
+
+    for i in range(0, len(message_ids), METADATA_BATCH_SIZE):
+        found, missing = await gmail.batch_get_metadata(
+            message_ids[i:i + METADATA_BATCH_SIZE], METADATA_HEADERS
+        )
+        out.update(found)
+        failed.extend(missing)
+
+    for mid in failed:
+        try:
+            out[mid] = await gmail.get_message_metadata(mid, METADATA_HEADERS)
+        except GoogleApiError as e:
+            if e.status != 404:
+                raise
+
+    return out
+
+# Beyond this many new messages, a bounded query scan is cheaper than fetching them all
+HISTORY_MAX_MESSAGES = 500
+
+# Gmail search skips these by default, so incremental sync does too
+_SKIPPED_LABELS = {"SPAM", "TRASH"}
+
+async def _get_history_id(gmail: GmailClient) -> Optional[str]:
+    resp = await gmail.get_profile()
+    return resp.get("historyId")
+
+async def _list_history_message_ids(gmail: GmailClient, start_history_id: str) -> Tuple[Optional[List[str]], Optional[str]]:
+    """
+    List messages added to the mailbox since `start_history_id` (users.history.list).
+    Returns (message_ids, latest_history_id), or (None, None) when the history id
+    has expired or there is too much new mail, so the caller falls back to a full scan.
+    """
+    ids: List[str] = []
+    seen = set()
+    page_token = None
+    while True:
+        try:
+            resp = await gmail.list_history(start_history_id, page_token=page_token)
+        except GoogleApiError as e:
+            # 404 = startHistoryId too old, Gmail no longer has that history
+            if e.status == 404:
+                return None, None
+            raise
+
+        for h in resp.get("history", []):
+            for added in h.get("messagesAdded", []):
+                msg = added.get("message") or {}
+                mid = msg.get("id")
+                if not mid or mid in seen or _SKIPPED_LABELS & set(msg.get("labelIds", [])):
+                    continue
+                seen.add(mid)
+                ids.append(mid)
+
+        if len(ids) > HISTORY_MAX_MESSAGES:
+            return None, None
+
+        page_token = resp.get("nextPageToken")
+        if not page_token:
+            return ids, resp.get("historyId")
+
+def _stage(stats: Dict[str, Any], stage: str, started: float) -> None:
+    """Record time spent in a scan stage since `started` (perf_counter)."""
+    seconds = time.perf_counter() - started
+    SCAN_STAGE_SECONDS.labels(stage).observe(seconds)
+    stats["stageMs"][stage] = round(stats["stageMs"].get(stage, 0.0) + seconds * 1000, 1)
 
 def _internal_date_int(msg: Dict[str, Any]) -> int:
     try:
@@ -41,104 +156,419 @@ def _internal_date_int(msg: Dict[str, Any]) -> int:
         return 0
 
 def _end_date_guess_from_internaldate(internal_date_ms: int) -> date:
-    # V1 : on n'extrait pas la vraie endDate → on met “dans 7 jours” par défaut
-    # (tu pourras remplacer par un vrai parser ensuite)
+    # Fallback when extract_trial_details finds no end date in the email
     dt = datetime.fromtimestamp(internal_date_ms / 1000, tz=timezone.utc)
     return (dt.date())
 
-async def scan_gmail_for_user(user: dict, *, max_results: int = 50) -> int:
+async def scan_gmail_for_user(
+    user: dict,
+    *,
+    max_results: int = 50,
+    incremental: bool = True,
+    stats: Optional[Dict[str, Any]] = None,
+    trial_writer: Optional[BulkWriter] = None,
+    user_writer: Optional[BulkWriter] = None,
+    reminder_writer: Optional[BulkWriter] = None,
+    on_saved: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> int:
     """
     Scan Gmail for a single user and create trials in MongoDB.
     Returns number of newly created trials.
+
+    With `incremental`, users that have a stored `gmail.historyId` only get the
+    messages added since the last scan (users.history.list); otherwise, or when
+    that history id has expired, TRIAL_QUERY_V1 is run as a full query scan:
+    results are paged lazily and listing stops at the first page reaching
+    `gmail.lastSeenInternalDate`, with `max_results` as a hard cap.
+    If `stats` is given, it is filled with per-user counters (messages fetched,
+    mode, Gmail retries, time spent waiting on the rate limiter and per stage:
+    list, metadata, detect, upsert).
+
+    Trial upserts, the reminders of created trials and the final user update go
+    through bulk writers. Callers scanning many users pass shared writers (see
+    scan_all_users); `stats["created"]` is then only final once those writers
+    have flushed, and the return value counts the trials queued for upsert.
+    Without writers, private ones are flushed before returning and the exact
+    number of created trials is returned. `on_saved(stats)` is called once the
+    user's scan state is written, when every trial and count of this scan is final.
     """
+    if stats is None:
+        stats = {}
+    stats.setdefault("messages", 0)
+    stats.setdefault("created", 0)
+    stats.setdefault("duplicates", 0)
+    stats.setdefault("retries", 0)
+    stats.setdefault("throttledMs", 0.0)
+    stats.setdefault("stageMs", {})
+
     db = get_db()
+    if trial_writer is None or user_writer is None or reminder_writer is None:
+        trials = BulkWriter(db.trials, max_ops=SCAN_BULK_MAX_OPS)
+        reminders = BulkWriter(db.reminders, flush_first=[trials])
+        users = BulkWriter(db.users, flush_first=[reminders])
+        await scan_gmail_for_user(
+            user,
+            max_results=max_results,
+            incremental=incremental,
+            stats=stats,
+            trial_writer=trials,
+            user_writer=users,
+            reminder_writer=reminders,
+            on_saved=on_saved,
+        )
+        await users.flush()
+        return stats["created"]
+
+    gmail = gmail_client_for_user(user)
+    usage_before = dict(gmail.usage)
+    try:
+        gmail_state = user.get("gmail") or {}
+        last_seen = gmail_state.get("lastSeenInternalDate", 0)
+        newest_seen = last_seen
+
+        message_ids = None
+        history_id = gmail_state.get("historyId")
+        if incremental and history_id:
+            started = time.perf_counter()
+            message_ids, history_id = await _list_history_message_ids(gmail, history_id)
+            _stage(stats, "list", started)
+            stats["mode"] = "incremental"
 
-    gmail = build_gmail_service_from_user(user)
+        if message_ids is None:
+            # Read the history id before listing so nothing added meanwhile is missed
+            started = time.perf_counter()
+            history_id = await _get_history_id(gmail)
+            _stage(stats, "list", started)
+            pages = _iter_message_id_pages(
+                gmail, _query_since(TRIAL_QUERY_V1, last_seen), max_results=max_results
+            )
+            stats["mode"] = "full"
+        else:
+            pages = _iter_chunks(message_ids)
 
-    last_seen = (user.get("gmail") or {}).get("lastSeenInternalDate", 0)
-    newest_seen = last_seen
+        queued = 0
 
-    messages = await _list_messages(gmail, TRIAL_QUERY_V1, max_results=max_results)
-    if not messages:
-        await db.users.update_one(
-            {"_id": user["_id"]},
-            {"$set": {"gmail.lastScanAt": datetime.now(timezone.utc)}}
+        try:
+            listed = time.perf_counter()
+            async for page in pages:
+                _stage(stats, "list", listed)
+                stats["messages"] += len(page)
+                started = time.perf_counter()
+                metas = await _get_messages_metadata(gmail, page)
+                _stage(stats, "metadata", started)
+                queued += await _process_messages(
+                    trial_writer, reminder_writer, user, page, metas, last_seen, stats
+                )
+                page_newest = max((_internal_date_int(m) for m in metas.values()), default=0)
+                newest_seen = max(newest_seen, page_newest)
+                # Query pages come newest first: once a page reaches mail we already
+                # scanned, every later page is older still
+                if stats["mode"] == "full" and any(
+                    _internal_date_int(m) <= last_seen for m in metas.values()
+                ):
+                    break
+                listed = time.perf_counter()
+        finally:
+            await pages.aclose()
+
+        watch = await watch_updates(gmail, user)
+        watch_expiration = watch.get("gmail.watchExpiration") or gmail_state.get("watchExpiration")
+        user_update: Dict[str, Any] = {"$set": {
+            "gmail.lastSeenInternalDate": newest_seen,
+            "gmail.historyId": history_id,
+            "gmail.lastScanAt": datetime.now(timezone.utc),
+            **watch,
+            **await schedule_updates(db, user, queued, watch_expiration),
+            **gmail.token_updates(),
+        }}
+        if queued:
+            # New trials: cached trial reads of this user are stale (see routes/trials.py)
+            user_update["$inc"] = {"trialsVersion": 1}
+        started = time.perf_counter()
+        await user_writer.add(
+            UpdateOne({"_id": user["_id"]}, user_update),
+            _on_user_saved(user, stats, on_saved),
         )
-        return 0
+        _stage(stats, "upsert", started)
+
+        return queued
+    finally:
+        # Throttling and retries are reported apart from failures
+        stats["retries"] += gmail.usage["retries"] - usage_before["retries"]
+        stats["throttledMs"] += round(gmail.usage["throttledMs"] - usage_before["throttledMs"], 1)
 
-    created = 0
+def _on_user_saved(
+    user: dict,
+    stats: Dict[str, Any],
+    on_saved: Optional[Callable[[Dict[str, Any]], None]],
+):
+    def _callback(upserted: bool, error_code: Optional[int]):
+        invalidate_user(user["_id"])
+        if on_saved is not None:
+            on_saved(stats)
+    return _callback
 
-    for m in messages:
-        mid = m["id"]
-        meta = await _get_message_metadata(gmail, mid)
+async def _process_messages(
+    trial_writer: BulkWriter,
+    reminder_writer: BulkWriter,
+    user: dict,
+    message_ids: List[str],
+    metas: Dict[str, Dict[str, Any]],
+    last_seen: int,
+    stats: Dict[str, Any],
+) -> int:
+    """
+    Run the detector on one page of messages and queue an upsert per candidate.
+    Returns the number of queued upserts; `stats` is updated once they are flushed,
+    and the reminders of each trial actually created are queued at that point.
+    The upsert stage is the time spent queueing, including the flushes it
+    triggers; bulk_write times are in the MongoDB command metrics.
+    """
+    started = time.perf_counter()
+
+    def _on_result(doc: dict):
+        def _callback(upserted: bool, error_code: Optional[int]):
+            if upserted:
+                stats["created"] += 1
+                for op in reminder_ops(doc, user):
+                    reminder_writer.add_nowait(op)
+                events.publish(doc["userId"], "created", doc)
+            elif error_code == 11000:
+                # Same (serviceName, endDate) already tracked for this user
+                stats["duplicates"] += 1
+        return _callback
+
+    new_messages = []
+    for mid in message_ids:
+        meta = metas.get(mid)
+        if meta is None:
+            continue
 
         internal_date = _internal_date_int(meta)
         if internal_date <= last_seen:
             continue
-        newest_seen = max(newest_seen, internal_date)
 
         hdr = _headers(meta.get("payload", {}))
-        subject = hdr.get("Subject", "")
-        sender = hdr.get("From", "")
-        snippet = meta.get("snippet", "")
+        new_messages.append((
+            mid,
+            internal_date,
+            hdr.get("Subject", ""),
+            hdr.get("From", ""),
+            meta.get("snippet", ""),
+        ))
+
+    candidates = are_trial_candidates((subject, sender, snippet) for _, _, subject, sender, snippet in new_messages)
 
-        if not is_trial_candidate(subject, sender, snippet):
+    docs = []
+    for (mid, internal_date, subject, sender, snippet), is_candidate in zip(new_messages, candidates):
+        if not is_candidate:
             continue
 
-        # --- V1: create a trial with minimal info ---
-        # You can later replace this with parser extraction.
+        received_at = datetime.fromtimestamp(internal_date / 1000, tz=timezone.utc)
+        details = extract_trial_details(subject, sender, snippet, received_at=received_at)
+        end_date = details["endDate"] or _end_date_guess_from_internaldate(internal_date)
+
         doc = {
+            # Set here so the reminders can reference the trial once it is inserted
+            "_id": ObjectId(),
             "userId": str(user["_id"]),
             "serviceName": subject[:80] or "Unknown service",
-            "endDate": datetime.combine(_end_date_guess_from_internaldate(internal_date), datetime.min.time()).replace(tzinfo=timezone.utc),
+            "endDate": datetime.combine(end_date, datetime.min.time()).replace(tzinfo=timezone.utc),
             "cancelUrl": None,
-            "renewalPrice": None,
+            "renewalPrice": details["renewalPrice"],
+            "currency": details["currency"],
             "status": "detected",
             "source": "gmail",
             "links": {"gmailMessageId": mid},
             "createdAt": datetime.now(timezone.utc),
             "updatedAt": datetime.now(timezone.utc),
         }
+        docs.append(doc)
+    _stage(stats, "detect", started)
 
+    started = time.perf_counter()
+    for doc in docs:
         # Upsert on (userId + gmailMessageId) to prevent duplicates
-        res = await db.trials.update_one(
-            {"userId": str(user["_id"]), "links.gmailMessageId": mid},
+        await trial_writer.add(UpdateOne(
+            {"userId": str(user["_id"]), "links.gmailMessageId": doc["links"]["gmailMessageId"]},
             {"$setOnInsert": doc},
             upsert=True
+        ), _on_result(doc))
+    _stage(stats, "upsert", started)
+
+    return len(docs)
+
+def _failure_type(exc: BaseException) -> str:
+    if isinstance(exc, asyncio.TimeoutError):
+        return "timeout"
+    if isinstance(exc, GoogleApiError):
+        return f"http_{exc.status}"
+    return type(exc).__name__
+
+async def scan_user_with_stats(
+    user: dict,
+    *,
+    max_results: int,
+    incremental: bool,
+    timeout: Optional[float],
+    trial_writer: BulkWriter,
+    user_writer: BulkWriter,
+    reminder_writer: BulkWriter,
+    on_saved: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> Dict[str, Any]:
+    """
+    Run scan_gmail_for_user under an optional timeout and return its per-user stats.
+    `created` / `duplicates` keep filling in until the shared writers are flushed.
+    """
+    stats: Dict[str, Any] = {
+        "userId": str(user["_id"]),
+        "created": 0,
+        "duplicates": 0,
+        "messages": 0,
+        "retries": 0,
+        "throttledMs": 0.0,
+        "stageMs": {},
+        "mode": None,
+        "durationMs": 0,
+        "error": None,
+    }
+    started = time.perf_counter()
+    try:
+        await asyncio.wait_for(
+            scan_gmail_for_user(
+                user,
+                max_results=max_results,
+                incremental=incremental,
+                stats=stats,
+                trial_writer=trial_writer,
+                user_writer=user_writer,
+                reminder_writer=reminder_writer,
+                on_saved=on_saved,
+            ),
+            timeout,
         )
-        if res.upserted_id:
-            created += 1
+    except Exception as e:
+        stats["error"] = _failure_type(e)
+    stats["durationMs"] = round((time.perf_counter() - started) * 1000, 1)
+    return stats
 
-    await db.users.update_one(
-        {"_id": user["_id"]},
-        {"$set": {
-            "gmail.lastSeenInternalDate": newest_seen,
-            "gmail.lastScanAt": datetime.now(timezone.utc),
-        }}
-    )
+# users who have Google tokens
+SCANNABLE_USERS = {
+    "provider": "google",
+    "googleTokens.refreshToken": {"$exists": True, "$ne": None}
+}
 
-    return created
+def scannable_users(due_only: bool = True) -> Dict[str, Any]:
+    if not due_only:
+        return SCANNABLE_USERS
+    return {**SCANNABLE_USERS, **due_filter(datetime.now(timezone.utc))}
 
-async def scan_all_users(*, max_results_per_user: int = 50) -> Dict[str, int]:
+def scan_writers(db) -> Tuple[BulkWriter, BulkWriter, BulkWriter]:
+    """
+    (trial_writer, reminder_writer, user_writer) shared by concurrent user scans.
+    Each one flushes the previous one first: a user's scan state is never
+    written ahead of the trials and reminders it covers.
+    """
+    trial_writer = BulkWriter(
+        db.trials, max_ops=SCAN_BULK_MAX_OPS, max_delay=SCAN_BULK_MAX_DELAY_SECONDS
+    )
+    reminder_writer = BulkWriter(
+        db.reminders,
+        max_ops=SCAN_BULK_MAX_OPS,
+        max_delay=SCAN_BULK_MAX_DELAY_SECONDS,
+        flush_first=[trial_writer],
+    )
+    user_writer = BulkWriter(
+        db.users,
+        max_ops=SCAN_BULK_MAX_OPS,
+        max_delay=SCAN_BULK_MAX_DELAY_SECONDS,
+        flush_first=[reminder_writer],
+    )
+    return trial_writer, reminder_writer, user_writer
+
+async def scan_all_users(
+    *,
+    max_results_per_user: int = 50,
+    concurrency: int = 1,
+    incremental: bool = True,
+    per_user_timeout: Optional[float] = None,
+    due_only: bool = True,
+) -> Dict[str, Any]:
+    """
+    Scan every Google user whose next scan is due (every one without
+    `due_only`), at most `concurrency` users at a time.
+    Users are streamed from the cursor into a bounded queue drained by
+    `concurrency` workers, so memory stays flat however many users there are.
+    Trial upserts, reminders and user scan state from all workers share bulk
+    writers flushed every SCAN_BULK_MAX_OPS operations or SCAN_BULK_MAX_DELAY_SECONDS.
+    Returns totals, time per scan stage, failures by type, write counts and per-user stats.
+    """
     db = get_db()
+    concurrency = max(1, concurrency)
 
-    # users who have Google tokens
-    cursor = db.users.find({
-        "provider": "google",
-        "googleTokens.refreshToken": {"$exists": True, "$ne": None}
-    })
+    cursor = db.users.find(scannable_users(due_only))
 
-    users = 0
-    created = 0
-    failed = 0
+    totals: Dict[str, Any] = {
+        "users": 0,
+        "created": 0,
+        "failed": 0,
+        "duplicates": 0,
+        "messages": 0,
+        "retries": 0,
+        "throttledMs": 0.0,
+        "stageMs": {},
+        "failures": {},
+        "writes": {},
+        "perUser": [],
+    }
+    queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
 
-    async for user in cursor:
-        users += 1
+    async def _worker():
+        while True:
+            user = await queue.get()
+            if user is None:
+                return
+            stats = await scan_user_with_stats(
+                user,
+                max_results=max_results_per_user,
+                incremental=incremental,
+                timeout=per_user_timeout,
+                trial_writer=trial_writer,
+                user_writer=user_writer,
+                reminder_writer=reminder_writer,
+            )
+            totals["messages"] += stats["messages"]
+            totals["retries"] += stats["retries"]
+            totals["throttledMs"] += stats["throttledMs"]
+            for stage, ms in stats["stageMs"].items():
+                totals["stageMs"][stage] = round(totals["stageMs"].get(stage, 0.0) + ms, 1)
+            if stats["error"]:
+                totals["failed"] += 1
+                totals["failures"][stats["error"]] = totals["failures"].get(stats["error"], 0) + 1
+            totals["perUser"].append(stats)
+
+    trial_writer, reminder_writer, user_writer = scan_writers(db)
+    # user_writer exits first, and its final flush flushes trial_writer then
+    # reminder_writer before it
+    async with trial_writer, reminder_writer, user_writer:
+        workers = [asyncio.create_task(_worker()) for _ in range(concurrency)]
         try:
-            created += await scan_gmail_for_user(user, max_results=max_results_per_user)
-        except HttpError:
-            failed += 1
-        except Exception:
-            failed += 1
+            async for user in cursor:
+                totals["users"] += 1
+                await queue.put(user)
+        finally:
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+
+    # Per-user upsert counts are final now that both writers have flushed
+    for stats in totals["perUser"]:
+        totals["created"] += stats["created"]
+        totals["duplicates"] += stats["duplicates"]
+    totals["writes"] = {
+        "trials": trial_writer.stats,
+        "reminders": reminder_writer.stats,
+        "users": user_writer.stats,
+    }
 
-    return {"users": users, "created": created, "failed": failed}
+    return totals
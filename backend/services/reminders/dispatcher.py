@@ -0,0 +1,123 @@
+# services/reminders/dispatcher.py
+from __future__ import annotations
+import asyncio
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+from pymongo import UpdateOne
+
+from core.config import (
+    REMINDER_BATCH_SIZE,
+    REMINDER_LEASE_SECONDS,
+    REMINDER_MAX_ATTEMPTS,
+    REMINDER_POLL_SECONDS,
+)
+from core.database import get_db
+from services.reminders.senders import get_sender
+
+# Failed sends are retried after 1, 2, 4, ... minutes
+RETRY_BASE_SECONDS = 60
+
+
+def _due_filter(now: datetime) -> dict:
+    # Served by the (status, fireAt) index; expired leases are claimable again
+    return {
+        "status": "pending",
+        "fireAt": {"$lte": now},
+        "$or": [{"leaseUntil": None}, {"leaseUntil": {"$lte": now}}],
+    }
+
+async def claim_due(db, now: datetime, limit: int, lease_seconds: float) -> List[dict]:
+    """
+    Lease up to `limit` due reminders for this worker. The update re-checks the
+    due filter per document, so two dispatchers never claim the same reminder.
+    """
+    ids = [d["_id"] async for d in db.reminders.find(_due_filter(now), {"_id": 1}).sort("fireAt", 1).limit(limit)]
+    if not ids:
+        return []
+    lease = uuid.uuid4().hex
+    await db.reminders.update_many(
+        {"_id": {"$in": ids}, **_due_filter(now)},
+        {"$set": {"leaseUntil": now + timedelta(seconds=lease_seconds), "leaseId": lease}},
+    )
+    return [d async for d in db.reminders.find({"_id": {"$in": ids}, "leaseId": lease})]
+
+async def _send(reminder: dict) -> Optional[str]:
+    try:
+        await get_sender(reminder["channel"])(reminder)
+        return None
+    except Exception as e:
+        return f"{type(e).__name__}: {e}"
+
+def _outcome(reminder: dict, error: Optional[str], now: datetime) -> Dict[str, Any]:
+    if error is None:
+        return {"$set": {"status": "sent", "sentAt": now, "leaseUntil": None}}
+    attempts = reminder.get("attempts", 0) + 1
+    update: Dict[str, Any] = {"attempts": attempts, "lastError": error}
+    if attempts >= REMINDER_MAX_ATTEMPTS:
+        update.update(status="failed", leaseUntil=None)
+    else:
+        # The lease doubles as the retry delay
+        delay = RETRY_BASE_SECONDS * 2 ** (attempts - 1)
+        update["leaseUntil"] = now + timedelta(seconds=delay)
+    return {"$set": update}
+
+async def dispatch_due(
+    *,
+    batch_size: int = REMINDER_BATCH_SIZE,
+    lease_seconds: float = REMINDER_LEASE_SECONDS,
+) -> Dict[str, int]:
+    """
+    Send every reminder due now, one leased batch at a time.
+    A reminder whose day is already over (dispatcher down, trial added late)
+    is marked `missed` instead of being sent a day late.
+    Returns counts by outcome.
+    """
+    db = get_db()
+    stats = {"claimed": 0, "sent": 0, "failed": 0, "missed": 0}
+
+    while True:
+        now = datetime.now(timezone.utc)
+        batch = await claim_due(db, now, batch_size, lease_seconds)
+        if not batch:
+            return stats
+        stats["claimed"] += len(batch)
+
+        ops = []
+        to_send = []
+        for r in batch:
+            fire_at = r["fireAt"] if r["fireAt"].tzinfo else r["fireAt"].replace(tzinfo=timezone.utc)
+            if fire_at + timedelta(days=1) <= now:
+                ops.append(UpdateOne({"_id": r["_id"]}, {"$set": {"status": "missed", "leaseUntil": None}}))
+                stats["missed"] += 1
+            else:
+                to_send.append(r)
+
+        errors = await asyncio.gather(*(_send(r) for r in to_send))
+        done = datetime.now(timezone.utc)
+        for r, error in zip(to_send, errors):
+            ops.append(UpdateOne({"_id": r["_id"], "leaseId": r["leaseId"]}, _outcome(r, error, done)))
+            stats["sent" if error is None else "failed"] += 1
+
+        await db.reminders.bulk_write(ops, ordered=False)
+        if len(batch) < batch_size:
+            return stats
+
+async def run_dispatcher(
+    poll_seconds: float = REMINDER_POLL_SECONDS,
+    *,
+    batch_size: int = REMINDER_BATCH_SIZE,
+) -> None:
+    """
+    Dispatch forever, polling for due reminders every `poll_seconds`.
+    Run by `python -m jobs.reminder_runner` (the Procfile's `reminders`):
+    without it, reminders stay pending.
+    """
+    while True:
+        try:
+            stats = await dispatch_due(batch_size=batch_size)
+            if stats["claimed"]:
+                print("REMINDERS:", stats)
+        except Exception as e:
+            print(f"⚠️  reminder dispatch failed: {e}")
+        await asyncio.sleep(poll_seconds)
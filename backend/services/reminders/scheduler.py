@@ -0,0 +1,104 @@
+# services/reminders/scheduler.py
+from __future__ import annotations
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional
+from pymongo import DeleteMany, UpdateOne
+
+from core.config import REMINDER_DEFAULT_CHANNEL
+
+# Same default as the preferences written at signup (routes/oauth.py)
+DEFAULT_ALERT_DAYS = [5, 3, 1]
+
+# No reminders for trials in these states
+INACTIVE_STATUSES = ("canceled", "expired")
+
+
+def alert_days(user: Optional[dict]) -> List[int]:
+    days = ((user or {}).get("preferences") or {}).get("alertDays") or DEFAULT_ALERT_DAYS
+    return sorted({int(d) for d in days if 0 <= int(d) <= 365}, reverse=True)
+
+def alert_channel(user: Optional[dict]) -> str:
+    return ((user or {}).get("preferences") or {}).get("alertChannel") or REMINDER_DEFAULT_CHANNEL
+
+def _utc(dt: datetime) -> datetime:
+    return dt if dt.tzinfo is not None else dt.replace(tzinfo=timezone.utc)
+
+def fire_times(end_date: datetime, days: Iterable[int], now: datetime) -> Dict[int, datetime]:
+    """
+    {daysBefore: fireAt}. A J-d reminder fires when daysLeft (as computed by
+    GET /trials/upcoming) becomes d, i.e. at endDate - d days, and is kept
+    while that day is not over, so a trial added at J-2 still gets its J-2 reminder.
+    """
+    end_date = _utc(end_date)
+    out = {}
+    for d in days:
+        fire_at = end_date - timedelta(days=d)
+        if fire_at + timedelta(days=1) > now:
+            out[d] = fire_at
+    return out
+
+def reminder_ops(trial: dict, user: Optional[dict], now: Optional[datetime] = None) -> List[Any]:
+    """
+    Bulk operations bringing the `reminders` of one trial in line with its
+    endDate / status and the user's alertDays: pending reminders that no
+    longer apply are deleted, missing ones are upserted. Sent reminders are
+    left alone, so re-syncing an unchanged trial never sends twice.
+    """
+    now = now or datetime.now(timezone.utc)
+    trial_id = str(trial["_id"])
+    channel = alert_channel(user)
+
+    times: Dict[int, datetime] = {}
+    if trial.get("status") not in INACTIVE_STATUSES and trial.get("endDate") is not None:
+        times = fire_times(trial["endDate"], alert_days(user), now)
+
+    ops: List[Any] = [DeleteMany({
+        "trialId": trial_id,
+        "status": "pending",
+        "$nor": [{"channel": channel, "fireAt": {"$in": list(times.values())}}],
+    })]
+    for days_before, fire_at in times.items():
+        ops.append(UpdateOne(
+            {"trialId": trial_id, "channel": channel, "fireAt": fire_at},
+            {
+                # Denormalized so the dispatcher never has to join on trials
+                "$set": {
+                    "serviceName": trial.get("serviceName"),
+                    "endDate": _utc(trial["endDate"]),
+                    "cancelUrl": trial.get("cancelUrl"),
+                    "renewalPrice": trial.get("renewalPrice"),
+                },
+                "$setOnInsert": {
+                    "userId": trial["userId"],
+                    "daysBefore": days_before,
+                    "status": "pending",
+                    "attempts": 0,
+                    "leaseUntil": None,
+                    "createdAt": now,
+                },
+            },
+            upsert=True,
+        ))
+    return ops
+
+async def sync_reminders(db, trials: Iterable[dict], users: Dict[str, Optional[dict]]) -> None:
+    """
+    Re-schedule the reminders of `trials` in one bulk_write.
+    `users` maps userId -> user document (for preferences); missing users get
+    the defaults.
+    """
+    ops: List[Any] = []
+    now = datetime.now(timezone.utc)
+    for trial in trials:
+        ops.extend(reminder_ops(trial, users.get(trial["userId"]), now))
+    if ops:
+        await db.reminders.bulk_write(ops, ordered=False)
+
+async def sync_trial_reminders(db, trial: dict, user: Optional[dict]) -> None:
+    await sync_reminders(db, [trial], {trial["userId"]: user})
+
+async def drop_trial_reminders(db, trial_ids: Iterable[Any]) -> None:
+    """Forget the pending reminders of deleted trials."""
+    ids = [str(t) for t in trial_ids]
+    if ids:
+        await db.reminders.delete_many({"trialId": {"$in": ids}, "status": "pending"})
@@ -0,0 +1,28 @@
+# services/reminders/senders.py
+from __future__ import annotations
+from typing import Awaitable, Callable, Dict
+
+# A sender delivers one reminder document on its channel and raises on failure
+Sender = Callable[[dict], Awaitable[None]]
+
+SENDERS: Dict[str, Sender] = {}
+
+
+def register_sender(channel: str, sender: Sender) -> None:
+    """Plug a delivery channel (email, push, ...) into the dispatcher."""
+    SENDERS[channel] = sender
+
+def get_sender(channel: str) -> Sender:
+    try:
+        return SENDERS[channel]
+    except KeyError:
+        raise LookupError(f"No sender for reminder channel {channel!r}")
+
+async def log_sender(reminder: dict) -> None:
+    end_date = reminder["endDate"].date().isoformat()
+    print(
+        f"🔔 J-{reminder['daysBefore']} user={reminder['userId']} "
+        f"trial={reminder['trialId']} {reminder.get('serviceName')!r} ends {end_date}"
+    )
+
+register_sender("log", log_sender)
@@ -79,6 +79,7 @@ document.addEventListener("DOMContentLoaded", async () => {
       await refreshSubscriptionsFromDB();
     }
     showDashboard();
+    startTrialStream();
   }
 });
 
@@ -155,6 +156,7 @@ function signup() {
 }
 
 async function logout() {
+    stopTrialStream();
     await logoutAPI();
 
     currentUser = null;
@@ -553,6 +555,30 @@ async function refreshSubscriptionsFromDB() {
   });
 }
 
+// ✅ Live updates: the server pushes trial changes (scanner, Gumloop, other tabs)
+let trialStream = null;
+let trialStreamTimer = null;
+
+function startTrialStream() {
+  if (trialStream || typeof EventSource === "undefined") return;
+  trialStream = new EventSource("/api/trials/stream", { withCredentials: true });
+
+  const onChange = () => {
+    // Several events in a row -> a single reload (answered by a 304 if nothing changed)
+    clearTimeout(trialStreamTimer);
+    trialStreamTimer = setTimeout(async () => {
+      await refreshSubscriptionsFromDB();
+      renderDashboard();
+    }, 300);
+  };
+  ["created", "updated", "deleted", "resync"].forEach(type => trialStream.addEventListener(type, onChange));
+}
+
+function stopTrialStream() {
+  if (trialStream) trialStream.close();
+  trialStream = null;
+}
+
 async function markCancelled(id) {
   try {
     await apiPatchTrial(id, { status: "canceled" });